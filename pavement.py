@@ -64,8 +64,7 @@ if paver.doctools.has_sphinx:
         """Build Paver's documentation and install it into paver/docs"""
         builtdocs = path("docs") / options.sphinx.builddir / "html"
         destdir = path("paver") / "docs"
-        destdir.rmtree()
-        builtdocs.move(destdir)
+        builtdocs.sync_to(destdir, delete=True)
     
     @task
     @needs('html', "minilib", "generate_setup", old_sdist)
@@ -46,6 +46,7 @@ True, False = 0==0, 0==1
 
 # Other package modules
 from paver.cog.whiteutils import *
+from paver.path import path
 
 class CogError(Exception):
     """ Any exception raised by Cog.
@@ -506,9 +507,7 @@ class Cog(Redirectable):
             else:
                 # Can't write!
                 raise CogError("Can't overwrite %s" % sOldPath)
-        f = open(sOldPath, "w")
-        f.write(sNewText)
-        f.close()
+        path(sOldPath).write_bytes(sNewText, if_changed=True)
 
     def saveIncludePath(self):
         self.savedInclude = self.options.includePath[:]
@@ -0,0 +1,318 @@
+"""Keeps a warm Paver process around for a project.
+
+Running ``paver --daemon`` in a project starts a server that imports Paver
+and runs the pavement once. While it is running, other ``paver`` commands
+in that project are sent to it over a Unix domain socket. Each one is run
+in a process forked from the server, so it starts with the pavement already
+loaded, and its output is streamed back to the command that sent it. The
+pavement is run again whenever it changes (modules that it imports are
+not reloaded).
+
+Commands run by the daemon get the environment variables of the command
+that sent them, but can't read from stdin."""
+
+import os
+import sys
+import atexit
+import errno
+import marshal
+import select
+import signal
+import socket
+import stat
+import struct
+import tempfile
+import traceback
+
+try:
+    from hashlib import md5
+except ImportError:
+    # compatibility for versions before 2.5
+    import md5
+    md5 = md5.new
+
+from paver import tasks
+
+def _available():
+    return hasattr(socket, "AF_UNIX") and hasattr(os, "fork")
+
+def _socket_dir():
+    """The directory holding the sockets of the current user's daemons,
+    which only that user can get into (the environment variables of
+    each command are sent through those sockets). Raises OSError if the
+    directory is there but isn't private."""
+    dirname = os.path.join(tempfile.gettempdir(), "paver-%s" % os.getuid())
+    try:
+        os.mkdir(dirname, 0700)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+    st = os.lstat(dirname)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or \
+        st.st_mode & 0077:
+        raise OSError(errno.EACCES, "%s is not a private directory" % 
+                      dirname)
+    return dirname
+
+def socket_path(pavement_file):
+    """The socket that the daemon for pavement_file listens on."""
+    digest = md5(os.path.abspath(pavement_file)).hexdigest()[:16]
+    return os.path.join(_socket_dir(), "%s.sock" % digest)
+
+def _is_own_socket(path):
+    """Whether path is a socket belonging to the current user."""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid()
+
+# The client sends a single "r" frame holding the command line and the
+# environment variables. The daemon answers with "o" (stdout) and "e"
+# (stderr) frames as the output arrives and finishes with an "x" frame
+# holding the exit code.
+
+def _send_frame(sock, kind, data):
+    sock.sendall(struct.pack("!cI", kind, len(data)) + data)
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        data = sock.recv(min(size, 65536))
+        if not data:
+            return None
+        chunks.append(data)
+        size -= len(data)
+    return "".join(chunks)
+
+def _recv_frame(sock):
+    header = _recv_exactly(sock, 5)
+    if header is None:
+        return None, None
+    kind, size = struct.unpack("!cI", header)
+    data = _recv_exactly(sock, size)
+    if data is None:
+        return None, None
+    return kind, data
+
+def run_client(pavement_file, args):
+    """Runs the command line args in the daemon serving pavement_file
+    and copies its output to stdout and stderr. Returns the exit code,
+    or None if there is no daemon running for that pavement."""
+    if not _available():
+        return None
+    try:
+        path = socket_path(pavement_file)
+    except OSError, e:
+        sys.stderr.write("Not using the paver daemon: %s\n" % e)
+        return None
+    if not _is_own_socket(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(path)
+        except socket.error:
+            return None
+        _send_frame(sock, "r", marshal.dumps((list(args), dict(os.environ))))
+        while True:
+            kind, data = _recv_frame(sock)
+            if kind is None:
+                sys.stderr.write("The paver daemon went away\n")
+                return 1
+            if kind == "o":
+                sys.stdout.write(data)
+                sys.stdout.flush()
+            elif kind == "e":
+                sys.stderr.write(data)
+                sys.stderr.flush()
+            elif kind == "x":
+                return int(data)
+    finally:
+        sock.close()
+
+def serve():
+    """Serves the pavement found from the current directory until the
+    process is interrupted or terminated."""
+    if not _available():
+        raise tasks.BuildFailure("paver --daemon needs a platform with "
+                                 "fork() and Unix domain sockets")
+    tasks._find_pavement()
+    if tasks.environment.pavement_file is None:
+        raise tasks.BuildFailure("There is no pavement for the daemon to "
+                                 "serve")
+    try:
+        daemon = _Daemon(tasks.environment.pavement_file)
+    except OSError, e:
+        raise tasks.BuildFailure("Can't start the paver daemon: %s" % e)
+    daemon.serve_forever()
+
+def _terminate(signum, frame):
+    sys.exit(0)
+
+class _Daemon(object):
+    def __init__(self, pavement_file):
+        self.pavement_file = pavement_file
+        self.socket_path = socket_path(pavement_file)
+        self.mtime = None
+        self.auto_pending = False
+        self.load_error = None
+
+    def reload_if_changed(self):
+        """Runs the pavement in a fresh environment if it has changed
+        since it was last run."""
+        mtime = os.path.getmtime(self.pavement_file)
+        if mtime == self.mtime:
+            return
+        self.mtime = mtime
+        env = tasks.Environment()
+        env.pavement_file = self.pavement_file
+        tasks.environment = env
+        try:
+            self.auto_pending = tasks._load_pavement()
+            self.load_error = None
+            env.info("Loaded %s", self.pavement_file)
+        except Exception:
+            self.load_error = traceback.format_exc()
+            env.error("Could not load %s:\n%s", self.pavement_file,
+                      self.load_error)
+
+    def _listen(self):
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                try:
+                    probe.connect(self.socket_path)
+                except socket.error:
+                    # left over from a daemon that didn't shut down cleanly
+                    os.remove(self.socket_path)
+                else:
+                    raise tasks.BuildFailure("A paver daemon is already "
+                        "running for %s" % self.pavement_file)
+            finally:
+                probe.close()
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0077)
+        try:
+            listener.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        listener.listen(5)
+        return listener
+
+    def serve_forever(self):
+        self.reload_if_changed()
+        listener = self._listen()
+        # the processes handling requests are reaped automatically
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, _terminate)
+        tasks.environment.info("Paver daemon for %s listening on %s",
+                               self.pavement_file, self.socket_path)
+        try:
+            while True:
+                try:
+                    conn = listener.accept()[0]
+                except socket.error, e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                self.reload_if_changed()
+                sys.stdout.flush()
+                sys.stderr.flush()
+                pid = os.fork()
+                if pid == 0:
+                    listener.close()
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                    try:
+                        self.handle(conn)
+                    except:
+                        traceback.print_exc()
+                    os._exit(0)
+                conn.close()
+        finally:
+            listener.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def handle(self, conn):
+        """Runs the request sent over conn in a child process and
+        relays its output."""
+        kind, data = _recv_frame(conn)
+        if kind != "r":
+            return
+        args, env = marshal.loads(data)
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                os.close(out_r)
+                os.close(err_r)
+                conn.close()
+                devnull = os.open(os.devnull, os.O_RDONLY)
+                os.dup2(devnull, 0)
+                os.dup2(out_w, 1)
+                os.dup2(err_w, 2)
+                code = self.run(args, env)
+            finally:
+                try:
+                    # os._exit skips atexit, which saves the caches, 
+                    # closes the log sinks and removes spilled output
+                    atexit._run_exitfuncs()
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                finally:
+                    os._exit(code)
+        os.close(out_w)
+        os.close(err_w)
+        streams = {out_r: "o", err_r: "e"}
+        try:
+            while streams:
+                for fd in select.select(streams.keys(), [], [])[0]:
+                    data = os.read(fd, 65536)
+                    if data:
+                        _send_frame(conn, streams[fd], data)
+                    else:
+                        os.close(fd)
+                        del streams[fd]
+        except socket.error:
+            # the client went away, so there's nobody to run this for
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+            return
+        status = os.waitpid(pid, 0)[1]
+        if os.WIFEXITED(status):
+            code = os.WEXITSTATUS(status)
+        else:
+            code = 1
+        _send_frame(conn, "x", str(code))
+
+    def run(self, args, env):
+        """Runs the command line in this (forked) process, the way
+        paver.tasks.main would. Returns the exit code."""
+        os.environ.clear()
+        os.environ.update(env)
+        if self.load_error:
+            sys.stderr.write("Could not load %s:\n%s" % (self.pavement_file,
+                                                         self.load_error))
+            return 1
+        environment = tasks.environment
+        try:
+            args = tasks._parse_global_options(args)
+            # -f has already been used to find this daemon
+            environment.pavement_file = self.pavement_file
+            tasks._process_commands(args, auto_pending=self.auto_pending)
+        except tasks.PavementError, e:
+            tasks._report_pavement_error(e)
+        except tasks.BuildFailure, e:
+            environment.error("Build failed: %s", e)
+            return 1
+        except SystemExit, e:
+            if e.code is None:
+                return 0
+            if isinstance(e.code, int):
+                return e.code
+            return 1
+        return 0
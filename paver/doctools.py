@@ -259,6 +259,9 @@ def _cogsh(cog):
             cog.gen.out(output)
     return shfunc
 
+# version control metadata, which cog never needs to look through
+_vcs_directories = ['.svn', '.git', '.hg', '.bzr', 'CVS', '_darcs']
+
 def _runcog(options, uncog=False):
     """Common function for the cog and runcog tasks."""
     
@@ -286,11 +289,9 @@ def _runcog(options, uncog=False):
         basedir = path(options.get('docroot', "docs")) / options.get('sourcedir', "")
     basedir = path(basedir)
         
-    pattern = options.get("pattern", "*.rst")
-    if pattern:
-        files = basedir.walkfiles(pattern)
-    else:
-        files = basedir.walkfiles()
+    pattern = options.get("pattern", "*.rst") or None
+    files = basedir.walkfiles(pattern, exclude=options.get("exclude"),
+                              prune=options.get("prune", _vcs_directories))
     for f in files:
         dry("cog %s" % f, c.processOneFile, f)
     
@@ -324,6 +325,14 @@ def cog(options):
     pattern
         file glob to look for under basedir. By default,
         *.rst
+    exclude
+        list of glob patterns for files (and directories) under
+        basedir to leave alone, as for path.walkfiles. You can 
+        read them from a file with paver.path.ignore_patterns.
+    prune
+        list of glob patterns for directories under basedir not
+        to look in. By default, version control directories
+        (.svn, .git and so on).
     includedir
         If you have external files to include in your
         documentation, setting includedir to the root
@@ -1,5 +1,7 @@
+import Queue
 import subprocess
 import sys
+import threading
 
 from paver import tasks
 from paver.options import Bunch
@@ -29,7 +31,48 @@ def debug(message, *args):
     set."""
     tasks.environment.debug(message, *args)
 
-def sh(command, capture=False, ignore_error=False, cwd=None):
+class _StreamReader(threading.Thread):
+    """Reads a subprocess' output stream as it arrives, so that the
+    subprocess never blocks on a full pipe. Each line is passed to log,
+    and is optionally written to output_file and kept in memory (only
+    the last limit bytes of it, if limit is given)."""
+    def __init__(self, stream, log, output_file=None, keep=False, 
+                 limit=None, lock=None):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.stream = stream
+        self.log = log
+        self.output_file = output_file
+        self.keep = keep
+        self.limit = limit
+        self.lock = lock
+        self.chunks = []
+        self.size = 0
+    
+    def run(self):
+        for line in iter(lambda: self.stream.readline(8192), ''):
+            self.log(line.rstrip("\r\n"))
+            if self.output_file is not None:
+                self.lock.acquire()
+                try:
+                    self.output_file.write(line)
+                finally:
+                    self.lock.release()
+            if self.keep:
+                self.chunks.append(line)
+                self.size += len(line)
+                if self.limit is not None:
+                    while self.size - len(self.chunks[0]) >= self.limit:
+                        self.size -= len(self.chunks.pop(0))
+    
+    def getvalue(self):
+        output = "".join(self.chunks)
+        if self.limit is not None:
+            output = output[-self.limit:]
+        return output
+
+def sh(command, capture=False, ignore_error=False, cwd=None,
+       output_file=None, capture_limit=None):
     """Runs an external command. If capture is True, the output of the
     command will be captured and returned as a string.  If the command 
     has a non-zero return code raise a BuildFailure. You can pass
@@ -37,25 +80,132 @@ def sh(command, capture=False, ignore_error=False, cwd=None):
     pass silently, silently into the night.  If you pass cwd='some/path'
     paver will chdir to 'some/path' before exectuting the command.
     
+    The output is read as the command produces it. Lines written to
+    stderr are displayed as errors, and captured output is shown in 
+    verbose mode. Pass capture_limit=N to keep only the last N bytes of 
+    the captured output in memory (N must be positive), and 
+    output_file='some/file' to write all of the output to a file as well.
+    
     If the dry_run option is True, the command will not
     actually be run."""
+    if capture_limit is not None and capture_limit <= 0:
+        raise ValueError("capture_limit must be positive, not %r"
+                         % (capture_limit,))
     def runpipe():
-        kwargs = { 'shell': True, 'cwd': cwd}
-        if capture:
-            kwargs['stderr'] = subprocess.STDOUT
+        kwargs = { 'shell': True, 'cwd': cwd, 'stderr': subprocess.PIPE}
+        if capture or output_file:
             kwargs['stdout'] = subprocess.PIPE
         p = subprocess.Popen(command, **kwargs)
-        p.wait()
+        if output_file:
+            output = open(output_file, "w")
+        else:
+            output = None
+        try:
+            lock = threading.Lock()
+            readers = [_StreamReader(p.stderr, error, output, lock=lock)]
+            if capture:
+                stdout_reader = _StreamReader(p.stdout, debug, output, 
+                                              keep=True, limit=capture_limit,
+                                              lock=lock)
+                readers.append(stdout_reader)
+            elif output_file:
+                readers.append(_StreamReader(p.stdout, info, output,
+                                             lock=lock))
+            for reader in readers:
+                reader.start()
+            for reader in readers:
+                reader.join()
+            p.wait()
+        finally:
+            if output is not None:
+                output.close()
         if p.returncode and not ignore_error:
             if capture:
-                error(p.stdout.read())
+                error(stdout_reader.getvalue())
             raise BuildFailure("Subprocess return code: %d" % p.returncode)
 
         if capture:
-            return p.stdout.read()
+            return stdout_reader.getvalue()
 
     return dry(command, runpipe)
 
+def sh_many(commands, jobs=None, ignore_error=False, cwd=None):
+    """Runs several external commands at once, no more than jobs of them
+    at a time (by default, one for each CPU). Returns a list holding the
+    output of each command, in the same order as commands.
+    
+    The output of each command (stdout and stderr together) is displayed
+    in one piece once the command finishes, with every line prefixed by
+    the command's number. If any of the commands has a non-zero return
+    code, a single BuildFailure listing all of them is raised after the
+    rest have finished, unless ignore_error is True. If you pass
+    cwd='some/path', the commands are run in 'some/path'.
+    
+    If the dry_run option is True, the commands will not actually be
+    run."""
+    commands = list(commands)
+    if tasks.environment.dry_run:
+        for number, command in enumerate(commands):
+            info("[%d] %s", number + 1, command)
+        return [None] * len(commands)
+    if jobs is None:
+        jobs = tasks._cpu_count()
+    results = [None] * len(commands)
+    pending = Queue.Queue()
+    for index in range(len(commands)):
+        pending.put(index)
+    output_lock = threading.Lock()
+    
+    def run(index):
+        prefix = "[%d] " % (index + 1)
+        info("%s%s", prefix, commands[index])
+        try:
+            p = subprocess.Popen(commands[index], shell=True, cwd=cwd,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT)
+            output = p.communicate()[0]
+            returncode = p.returncode
+        except Exception, e:
+            # reported along with the other failures
+            output = "%s\n" % e
+            returncode = -1
+        results[index] = (returncode, output)
+        if returncode and not ignore_error:
+            log = error
+        else:
+            log = info
+        output_lock.acquire()
+        try:
+            for line in output.splitlines():
+                log("%s%s", prefix, line)
+        finally:
+            output_lock.release()
+    
+    def worker():
+        while True:
+            try:
+                index = pending.get_nowait()
+            except Queue.Empty:
+                return
+            run(index)
+    
+    workers = [threading.Thread(target=worker)
+               for i in range(max(1, min(jobs, len(commands))))]
+    for t in workers:
+        t.setDaemon(True)
+        t.start()
+    for t in workers:
+        t.join()
+    
+    failures = ["[%d] %s (return code %d)" % (index + 1, commands[index], 
+                                             results[index][0])
+                for index in range(len(commands)) if results[index][0]]
+    if failures and not ignore_error:
+        raise BuildFailure("%d of %d commands failed:\n%s"
+                           % (len(failures), len(commands),
+                              "\n".join(failures)))
+    return [output for returncode, output in results]
+
 
 class _SimpleProxy(object):
     __initialized = False
@@ -92,6 +242,8 @@ call_task = _SimpleProxy(environment, "call_task")
 call_pavement = tasks.call_pavement
 task = tasks.task
 needs = tasks.needs
+inputs = tasks.inputs
+outputs = tasks.outputs
 cmdopts = tasks.cmdopts
 consume_args = tasks.consume_args
 no_auto = tasks.no_auto
@@ -1,7 +1,11 @@
 """Miscellaneous tasks that don't fit into one of the other groupings."""
 import os
+import sys
+import time
 
-from paver.easy import dry, path, task
+from paver import tasks
+from paver.easy import dry, path, task, cmdopts, info, environment, \
+    BuildFailure
 
 _docsdir = os.path.join(os.path.dirname(__file__), "docs")
 if os.path.exists(_docsdir):
@@ -52,16 +56,157 @@ def generate_setup():
     Otherwise, it will just assume that paver is available."""
     from paver.easy import dry
     def write_setup():
-        setup = open("setup.py", "w")
-        setup.write("""import os
+        path("setup.py").write_text("""import os
 if os.path.exists("paver-minilib.zip"):
     import sys
     sys.path.insert(0, "paver-minilib.zip")
 
 import paver.tasks
 paver.tasks.main()
-""")
-        setup.close()
+""", if_changed=True)
         
     dry("Write setup.py", write_setup)
-    
\ No newline at end of file
+    
+@task
+@cmdopts([
+    ('task=', 't', 'show the recent runs of this task'),
+    ('limit=', 'n', 'number of tasks (or runs) to show')
+])
+def history(options):
+    """Show the slowest tasks in the build history, with a note for each
+    task whose last run was much slower than the ones before. The 
+    history is kept next to the pavement, in .paver_history. Use --task
+    to see the recent runs of one task."""
+    if environment.history is None:
+        raise BuildFailure("There is no build history without a pavement")
+    limit = int(options.get('limit', 20))
+    runs = environment.history.runs()
+    name = options.get('task')
+    if name:
+        found = environment.get_task(name)
+        if found is not None:
+            name = found.name
+        runs = [run for run in runs if run["name"] == name]
+        if not runs:
+            info("No runs of %s have been recorded", name)
+            return
+        info("Recent runs of %s:", name)
+        for run in runs[-limit:]:
+            info("  %s %9.3fs  %-7s  %s", 
+                 time.strftime("%Y-%m-%d %H:%M:%S", 
+                               time.localtime(run["start"])),
+                 run["duration"], run["status"], run["host"])
+        return
+    
+    durations = {}
+    for run in runs:
+        if run["status"] == "ok":
+            durations.setdefault(run["name"], []).append(run["duration"])
+    if not durations:
+        info("No successful task runs have been recorded")
+        return
+    summary = []
+    for name, times in durations.items():
+        recent = times[-10:]
+        summary.append((sum(recent) / len(recent), name, times))
+    summary.sort(reverse=True)
+    info("Slowest tasks (average of the last 10 successful runs):")
+    info("%9s %9s %6s  %s", "average", "last", "runs", "task")
+    for average, name, times in summary[:limit]:
+        line = "%8.3fs %8.3fs %6d  %s" % (average, times[-1], len(times), 
+                                          name)
+        before = times[-11:-1]
+        if len(before) >= 2:
+            previous = sum(before) / len(before)
+            if previous and times[-1] > previous * 1.5 and \
+                    times[-1] - previous > 0.1:
+                line += "  (%d%% slower than before)" % (
+                    (times[-1] / previous - 1) * 100)
+        info(line)
+
+@task
+@cmdopts([
+    ('format=', 'f', 'dot (the default) or json'),
+    ('output=', 'o', 'file to write the graph to (instead of the screen)')
+])
+def graph(options):
+    """Show the tasks and what they need as a graph, for Graphviz (dot)
+    or as JSON. Tasks are labelled with their average duration from the
+    build history, and the critical path (the chain of needs that takes
+    longest) is highlighted. Use paver -q graph to get the graph
+    alone."""
+    output_format = options.get('format', 'dot')
+    if output_format not in ('dot', 'json'):
+        raise BuildFailure("Unknown graph format: %s" % output_format)
+    needs = {}
+    def add(t):
+        if t in needs:
+            return
+        needs[t] = []
+        for req in t.needs:
+            needed = environment._get_needed_task(t.name, req)
+            needs[t].append(needed)
+            add(needed)
+    for t in sorted(environment.get_tasks(), key=lambda t: t.name):
+        add(t)
+    
+    if environment.history is not None:
+        durations = environment.history.average_durations()
+    else:
+        durations = {}
+    lengths = tasks._path_lengths(needs, durations)
+    critical = []
+    def longest(candidates):
+        return sorted(candidates, key=lambda t: (lengths[t], t.name))[-1]
+    if lengths and max(lengths.values()) > 0:
+        current = longest(needs)
+        critical.append(current)
+        while needs[current]:
+            current = longest(needs[current])
+            critical.append(current)
+    
+    all_tasks = sorted(needs, key=lambda t: t.name)
+    if output_format == 'json':
+        try:
+            import json
+        except ImportError:
+            import simplejson as json
+        result = json.dumps(dict(
+            tasks=[dict(name=t.name, shortname=t.shortname,
+                        needs=[n.name for n in needs[t]],
+                        average_duration=durations.get(t.name),
+                        critical=t in critical)
+                   for t in all_tasks],
+            critical_path=[t.name for t in critical],
+            critical_path_duration=critical and lengths[critical[0]] or 0),
+            indent=1) + "\n"
+    else:
+        lines = ["digraph tasks {"]
+        for t in all_tasks:
+            label = t.shortname
+            if t.name in durations:
+                label += "\\n%.3fs" % durations[t.name]
+            attributes = 'label="%s"' % label
+            if t in critical:
+                attributes += ', color=red, penwidth=2'
+            lines.append('  "%s" [%s];' % (t.name, attributes))
+        for t in all_tasks:
+            for needed in needs[t]:
+                edge = '  "%s" -> "%s"' % (t.name, needed.name)
+                if t in critical and needed in critical:
+                    edge += ' [color=red, penwidth=2]'
+                lines.append(edge + ";")
+        lines.append("}")
+        result = "\n".join(lines) + "\n"
+    
+    output = options.get('output')
+    if output:
+        def write_graph():
+            f = open(output, "w")
+            try:
+                f.write(result)
+            finally:
+                f.close()
+        dry("Write the task graph to %s" % output, write_graph)
+    else:
+        sys.stdout.write(result)
@@ -29,7 +29,8 @@ This has been modified from the original to avoid dry run issues.
 #   - guess_content_type() method?
 #   - Perhaps support arguments to touch().
 
-import sys, warnings, os, fnmatch, glob, shutil, codecs
+import sys, warnings, os, fnmatch, glob, shutil, codecs, stat, re, errno
+import time, atexit, binascii, threading, Queue, tempfile, subprocess
 
 try:
     from hashlib import md5
@@ -38,8 +39,23 @@ except ImportError:
     import md5
     md5 = md5.new
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import mmap
+except ImportError:
+    mmap = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 __version__ = '2.2'
-__all__ = ['path']
+__all__ = ['path', 'ignore_patterns']
 
 # Platform-specific support for path.owner
 if os.name == 'nt':
@@ -81,9 +97,836 @@ if hasattr(file, 'newlines'):
     _textmode = 'U'
 
 
+# Directory listings that come with the type of each entry
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
+
 class TreeWalkWarning(Warning):
     pass
 
+def ignore_patterns(filename):
+    """ Reads the patterns in an ignore file like .gitignore, for the
+    exclude= and prune= arguments of the tree walkers. Blank lines and
+    comments are skipped, and so are negated (!) patterns, which the
+    walkers don't support.
+    """
+    f = open(filename)
+    try:
+        patterns = []
+        for line in f:
+            line = line.rstrip()
+            if line and not line.startswith('#') and \
+                    not line.startswith('!'):
+                patterns.append(line)
+        return patterns
+    finally:
+        f.close()
+
+def _translate(pattern):
+    """ Translates a glob pattern into a regular expression, in which
+    * and ? don't match / and ** matches across directories.
+    """
+    i, n = 0, len(pattern)
+    res = []
+    while i < n:
+        c = pattern[i]
+        i = i + 1
+        if c == '*':
+            if pattern[i:i+2] == '*/':
+                # any number of directories, including none
+                res.append('(?:.*/)?')
+                i = i + 2
+            elif pattern[i:i+1] == '*':
+                res.append('.*')
+                i = i + 1
+            else:
+                res.append('[^/]*')
+        elif c == '?':
+            res.append('[^/]')
+        elif c == '[':
+            j = i
+            if j < n and pattern[j] == '!':
+                j = j + 1
+            if j < n and pattern[j] == ']':
+                j = j + 1
+            while j < n and pattern[j] != ']':
+                j = j + 1
+            if j >= n:
+                res.append('\\[')
+            else:
+                stuff = pattern[i:j].replace('\\', '\\\\')
+                i = j + 1
+                if stuff[0] == '!':
+                    stuff = '^' + stuff[1:]
+                elif stuff[0] == '^':
+                    stuff = '\\' + stuff
+                res.append('[%s]' % stuff)
+        else:
+            res.append(re.escape(c))
+    return ''.join(res)
+
+class _PatternMatcher(object):
+    """ A list of glob patterns, compiled into as few regular
+    expressions as possible. Patterns without a / are matched against
+    the names of items, and the others against their paths relative to
+    the top of the walk (so a leading / ties a pattern to the top).
+    Patterns ending in / only match directories.
+    """
+    def __init__(self, patterns):
+        if isinstance(patterns, basestring):
+            patterns = [patterns]
+        groups = {}
+        for pattern in patterns:
+            dirs_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            on_path = '/' in pattern
+            pattern = pattern.lstrip('/')
+            if not pattern:
+                continue
+            groups.setdefault((on_path, dirs_only), []).append(
+                _translate(pattern))
+        flags = 0
+        if os.path.normcase('A') == 'a':
+            flags = re.IGNORECASE
+        self._regexes = []
+        for (on_path, dirs_only), regexes in groups.items():
+            regex = re.compile('(?:%s)\\Z' % '|'.join(regexes), flags)
+            self._regexes.append((on_path, dirs_only, regex))
+
+    def match(self, relpath, name, isdir):
+        """ relpath is relative to the top of the walk, with / between
+        its parts.
+        """
+        for on_path, dirs_only, regex in self._regexes:
+            if dirs_only and not isdir:
+                continue
+            if on_path:
+                if regex.match(relpath):
+                    return True
+            elif regex.match(name):
+                return True
+        return False
+
+class _GlobMatcher(object):
+    """ Glob patterns relative to the top of a walk, compiled into a
+    single regular expression. As with glob.glob, wildcards don't match
+    names starting with a dot, and a ** part matches any number of
+    directories. Used as the prune= matcher of the walk, it picks out
+    the directories in which none of the patterns can match.
+    """
+    def __init__(self, patterns):
+        flags = 0
+        if os.path.normcase('A') == 'a':
+            flags = re.IGNORECASE
+        regexes = []
+        self._prefixes = []
+        for pattern in patterns:
+            parts = pattern.split('/')
+            regex = []
+            for part in parts[:-1]:
+                if part == '**':
+                    regex.append('(?:(?!\\.)[^/]+/)*')
+                else:
+                    regex.append(_glob_part(part) + '/')
+            if parts[-1] == '**':
+                regex.append('(?!\\.)[^/]+(?:/(?!\\.)[^/]+)*')
+            else:
+                regex.append(_glob_part(parts[-1]))
+            regexes.append(''.join(regex))
+            # the directories that can hold matches are those that match
+            # the parts of the pattern before the first **, or are below
+            # a directory that does
+            if '**' in parts:
+                recursive = parts.index('**')
+            else:
+                recursive = None
+            fixed = parts[:recursive]
+            prefixes = {}
+            for depth in range(1, len(fixed) + 1):
+                prefix = '/'.join([_glob_part(part) for part in fixed[:depth]])
+                prefixes[depth] = re.compile(prefix + '\\Z', flags)
+            if recursive is not None:
+                if recursive:
+                    deep = re.compile(
+                        '/'.join([_glob_part(part) for part in fixed]) + '/',
+                        flags)
+                else:
+                    deep = re.compile('', flags)
+            else:
+                deep = None
+            self._prefixes.append((prefixes, len(parts), recursive, deep))
+        self._regex = re.compile('(?:%s)\\Z' % '|'.join(regexes), flags)
+
+    def matches(self, relpath):
+        return self._regex.match(relpath) is not None
+
+    def match(self, relpath, name, isdir):
+        """ True for the directories that can't hold any matches. """
+        depth = relpath.count('/') + 1
+        for prefixes, length, recursive, deep in self._prefixes:
+            if recursive is not None and depth > recursive:
+                if deep.match(relpath):
+                    return False
+            elif depth < length and prefixes[depth].match(relpath):
+                return False
+        return True
+
+def _glob_part(part):
+    """ The regular expression for one part (other than **) of a glob
+    pattern, as _GlobMatcher uses it.
+    """
+    regex = _translate(part.replace('**', '*'))
+    if not part.startswith('.'):
+        regex = '(?!\\.)' + regex
+    return regex
+
+# files modified more recently than this many seconds ago are not
+# cached, since file systems only record modification times so finely
+_racy_seconds = 2
+
+def _new_hash(algo):
+    try:
+        import hashlib
+    except ImportError:
+        # compatibility for versions before 2.5
+        if algo == 'md5':
+            return md5()
+        elif algo == 'sha1':
+            import sha
+            return sha.new()
+        raise ValueError("unsupported hash type %s" % algo)
+    return hashlib.new(algo)
+
+def _hash_file(filename, algo):
+    """ Hashes the file, mapped into memory if possible, otherwise
+    read a megabyte at a time.
+    """
+    m = _new_hash(algo)
+    f = open(filename, 'rb')
+    try:
+        mapped = None
+        if mmap is not None:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (EnvironmentError, ValueError, TypeError):
+                # empty files can't be mapped, for one
+                pass
+        if mapped is not None:
+            try:
+                m.update(mapped)
+            finally:
+                mapped.close()
+        else:
+            while True:
+                d = f.read(1024 * 1024)
+                if not d:
+                    break
+                m.update(d)
+    finally:
+        f.close()
+    return m.hexdigest()
+
+def _hash_key(filename, st):
+    if st.st_ino:
+        return (st.st_dev, st.st_ino)
+    # no inode numbers (Windows, with older Pythons)
+    return os.path.abspath(filename)
+
+class TreeHash(object):
+    """ The fingerprint of a directory tree made by path.hash_tree().
+
+    digest is the hash of the whole tree. files maps the path of each
+    file (relative to the top of the tree, with / between the parts)
+    to its hash, and subtrees does the same for the directories, with
+    '' for the top. Directories are hashed from the names and hashes
+    of what they hold, so a directory's hash changes exactly when
+    something in it does.
+    """
+    def __init__(self, files, algo='md5'):
+        self.algo = algo
+        self.files = files
+        self.subtrees = {}
+        self.children = {'': []}
+        for relpath in files:
+            parent, name = _split_relpath(relpath)
+            entry = (name, False)
+            while parent not in self.children:
+                self.children[parent] = [entry]
+                parent, name = _split_relpath(parent)
+                entry = (name, True)
+            self.children[parent].append(entry)
+        # deepest first, so that subdirectories are done before their
+        # parents
+        order = [(relpath.count('/'), relpath) for relpath in self.children
+                 if relpath]
+        order.sort()
+        order.reverse()
+        for depth, relpath in order + [(0, '')]:
+            self.subtrees[relpath] = self._hash_directory(relpath)
+        self.digest = self.subtrees['']
+
+    def _hash_directory(self, relpath):
+        m = _new_hash(self.algo)
+        children = self.children[relpath]
+        children.sort()
+        for name, isdir in children:
+            child = _join_relpath(relpath, name)
+            if isdir:
+                m.update("d %s\0%s\n" % (name, self.subtrees[child]))
+            else:
+                m.update("f %s\0%s\n" % (name, self.files[child]))
+        return m.hexdigest()
+
+    def changed(self, other):
+        """ The paths of the files and directories that are different
+        (or only present) in one of this TreeHash and other, sorted.
+        Only the subtrees whose hashes differ are looked at.
+        """
+        result = []
+        stack = ['']
+        while stack:
+            relpath = stack.pop()
+            if self.subtrees.get(relpath) == other.subtrees.get(relpath):
+                continue
+            if relpath:
+                result.append(relpath)
+            children = {}
+            for tree in (self, other):
+                for name, isdir in tree.children.get(relpath, []):
+                    children[name] = isdir or children.get(name, False)
+            for name, isdir in children.items():
+                child = _join_relpath(relpath, name)
+                if isdir:
+                    stack.append(child)
+                    if self.files.get(child) != other.files.get(child):
+                        # a file in one tree and a directory in the other
+                        result.append(child)
+                elif self.files.get(child) != other.files.get(child):
+                    result.append(child)
+        result.sort()
+        return result
+
+def _split_relpath(relpath):
+    parts = relpath.split('/')
+    return '/'.join(parts[:-1]), parts[-1]
+
+def _join_relpath(relpath, name):
+    if relpath:
+        return relpath + '/' + name
+    return name
+
+# days for which the hash cache keeps the hashes of files that aren't
+# looked at, and the most files it keeps
+_hash_cache_days = 30
+_hash_cache_limit = 100000
+
+class _HashCache(object):
+    """ The hashes of files, by file (device and inode) and then by
+    algorithm, along with the size and modification time the file had
+    and when the hashes were last used. The cache is saved to
+    file_hashes in the user's paver cache directory when Paver exits,
+    without the files that haven't been looked at for a while.
+    """
+    def __init__(self):
+        self._entries = None
+        self._dirty = False
+        # hash_tree's threads can all want the entries at once
+        self._load_lock = threading.Lock()
+
+    def _get_filename(self):
+        from paver import tasks
+        return os.path.join(tasks._user_cache_dir(), "file_hashes")
+
+    def _load(self):
+        if self._entries is not None:
+            return self._entries
+        self._load_lock.acquire()
+        try:
+            if self._entries is None:
+                try:
+                    f = open(self._get_filename(), "rb")
+                    try:
+                        entries = pickle.load(f)
+                    finally:
+                        f.close()
+                    self._entries = dict([(key, entry) 
+                                          for key, entry in entries.items()
+                                          if len(entry) == 3])
+                except Exception:
+                    self._entries = {}
+            return self._entries
+        finally:
+            self._load_lock.release()
+
+    def get(self, key, stamp, algo):
+        entries = self._load()
+        entry = entries.get(key)
+        if entry is None or entry[0] != stamp or algo not in entry[1]:
+            return None
+        now = time.time()
+        if now - entry[2] > 86400:
+            # it's enough to know the day it was last used on
+            entries[key] = (entry[0], entry[1], now)
+            self._changed()
+        return entry[1][algo]
+
+    def set(self, key, stamp, algo, digest):
+        entries = self._load()
+        entry = entries.get(key)
+        if entry is None or entry[0] != stamp:
+            entry = entries[key] = (stamp, {}, time.time())
+        entry[1][algo] = digest
+        self._changed()
+
+    def _changed(self):
+        if not self._dirty:
+            self._dirty = True
+            atexit.register(self.save)
+
+    def save(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+        oldest = time.time() - _hash_cache_days * 86400
+        entries = [(entry[2], key, entry)
+                   for key, entry in self._entries.items()
+                   if entry[2] >= oldest]
+        if len(entries) > _hash_cache_limit:
+            entries.sort()
+            entries = entries[-_hash_cache_limit:]
+        entries = dict([(key, entry) for used, key, entry in entries])
+        filename = self._get_filename()
+        try:
+            dirname = os.path.dirname(filename)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            fd, tmpname = _temp_beside(filename)
+            try:
+                f = os.fdopen(fd, "wb")
+                try:
+                    pickle.dump(entries, f, 2)
+                finally:
+                    f.close()
+                _rename_over(tmpname, filename)
+            except:
+                os.remove(tmpname)
+                raise
+        except (IOError, OSError):
+            pass
+
+_hash_cache = _HashCache()
+
+def _run_threaded(function, items, jobs=None):
+    """ Calls function with each of items, on up to jobs threads at
+    once (by default, one for each CPU). If any of the calls fail, the
+    rest are abandoned and the first exception is raised again.
+    """
+    pending = Queue.Queue()
+    for item in items:
+        pending.put(item)
+    failures = []
+    def worker():
+        while not failures:
+            try:
+                item = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                function(item)
+            except Exception:
+                failures.append(sys.exc_info())
+    if jobs is None:
+        from paver import tasks
+        jobs = tasks._cpu_count()
+    threads = [threading.Thread(target=worker)
+               for i in range(max(1, min(jobs, len(items))))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if failures:
+        exc_type, exc_value, exc_tb = failures[0]
+        raise exc_type, exc_value, exc_tb
+
+_copy_chunk = 1024 * 1024
+# errors meaning that a kernel copy can't be done between these files
+_no_kernel_copy = [errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EPERM,
+                   errno.EBADF, getattr(errno, 'EOPNOTSUPP', None),
+                   getattr(errno, 'ENOTSUP', None)]
+_libc = []
+
+def _get_libc():
+    """ The C library, through ctypes, for copy_file_range and
+    sendfile; None if those aren't available.
+    """
+    if not _libc:
+        libc = None
+        if sys.platform.startswith('linux'):
+            try:
+                import ctypes
+                import ctypes.util
+                libc = ctypes.CDLL(ctypes.util.find_library('c') or 
+                                   'libc.so.6', use_errno=True)
+                for name in ['copy_file_range', 'sendfile']:
+                    if hasattr(libc, name):
+                        getattr(libc, name).restype = ctypes.c_ssize_t
+            except (ImportError, OSError, AttributeError):
+                libc = None
+        _libc.append(libc)
+    return _libc[0]
+
+def _kernel_copy(fsrc, fdst, size):
+    """ Copies up to size bytes from the file descriptor fsrc to fdst,
+    from their current positions, without the data passing through
+    Python: with copy_file_range, or else sendfile. Stops early when
+    neither can be used, and leaves the positions after what was
+    copied so that the caller can finish the job.
+    """
+    libc = _get_libc()
+    if libc is None:
+        return
+    import ctypes
+    for name in ['copy_file_range', 'sendfile']:
+        call = getattr(libc, name, None)
+        if call is None:
+            continue
+        while size > 0:
+            count = ctypes.c_size_t(min(size, _copy_chunk))
+            if name == 'copy_file_range':
+                result = call(fsrc, None, fdst, None, count, 0)
+            else:
+                result = call(fdst, fsrc, None, count)
+            if result == 0:
+                break
+            if result < 0:
+                err = ctypes.get_errno()
+                if err == errno.EINTR:
+                    continue
+                if err in _no_kernel_copy:
+                    break
+                raise OSError(err, os.strerror(err))
+            size -= result
+        if size <= 0:
+            return
+
+def _temp_beside(filename):
+    """ Creates a temporary file in the directory of filename, for a new
+    version of it to be written to and then renamed over it with
+    _rename_over. Returns its file descriptor and name.
+    """
+    return tempfile.mkstemp(dir=os.path.dirname(filename) or os.curdir,
+                            prefix='.%s.' % os.path.basename(filename),
+                            suffix='.tmp')
+
+def _rename_over(tmpname, filename):
+    if os.name == 'nt' and os.path.exists(filename):
+        # rename can't replace files on Windows
+        os.remove(filename)
+    os.rename(tmpname, filename)
+
+def _copy_file(src, dst):
+    """ Copies the contents of the file src to dst, along with its
+    permission bits and times, in the kernel where possible. The copy
+    is made beside dst and then renamed over it, so a dst that is a
+    hard link to src is replaced rather than emptied.
+    """
+    fsrc = os.open(src, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        fdst, tmpname = _temp_beside(dst)
+        try:
+            try:
+                _kernel_copy(fsrc, fdst, os.fstat(fsrc).st_size)
+                while True:
+                    data = os.read(fsrc, _copy_chunk)
+                    if not data:
+                        break
+                    while data:
+                        data = data[os.write(fdst, data):]
+            finally:
+                os.close(fdst)
+            shutil.copystat(src, tmpname)
+            _rename_over(tmpname, dst)
+        except:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
+    finally:
+        os.close(fsrc)
+
+# from <linux/fs.h>
+_FICLONE = 0x40049409
+
+def _reflink(src, dst):
+    """ Makes dst a copy-on-write clone of the file src, sharing its
+    blocks, with the FICLONE ioctl (btrfs, XFS and others on Linux).
+    Returns False if the file system can't do that. As with
+    _copy_file, the clone is made beside dst and renamed over it.
+    """
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return False
+    fsrc = os.open(src, os.O_RDONLY)
+    try:
+        fdst, tmpname = _temp_beside(dst)
+        try:
+            try:
+                try:
+                    fcntl.ioctl(fdst, _FICLONE, fsrc)
+                except IOError, e:
+                    if (e.errno not in _no_kernel_copy and 
+                        e.errno != errno.ENOTTY):
+                        raise
+                    os.remove(tmpname)
+                    return False
+            finally:
+                os.close(fdst)
+            shutil.copystat(src, tmpname)
+            _rename_over(tmpname, dst)
+        except:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
+    finally:
+        os.close(fsrc)
+    return True
+
+def _hard_link(src, dst):
+    """ Makes dst a hard link to src, replacing any file already there.
+    Returns False if that can't be done.
+    """
+    if not hasattr(os, 'link'):
+        return False
+    try:
+        try:
+            os.link(src, dst)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+            os.remove(dst)
+            os.link(src, dst)
+    except OSError:
+        return False
+    return True
+
+_link_modes = [None, 'hard', 'reflink', 'auto']
+
+def _link_or_copy(src, dst, link):
+    """ Makes dst a copy of the file src the way link asks for: None
+    for a real copy, 'reflink' or 'hard' to try that first, or 'auto'
+    to try a reflink and then a hard link. Returns the method that was
+    used: 'reflink', 'hard' or 'copy'.
+    """
+    if link not in _link_modes:
+        raise ValueError("invalid link parameter: %r" % (link,))
+    if link in ('reflink', 'auto') and _reflink(src, dst):
+        method = 'reflink'
+    elif link in ('hard', 'auto') and _hard_link(src, dst):
+        method = 'hard'
+    else:
+        _copy_file(src, dst)
+        method = 'copy'
+    debug("%s %s -> %s", method, src, dst)
+    return method
+
+def _copytree(src, dst, link, symlinks=False, ignore=None):
+    """ shutil.copytree, with the files copied by _link_or_copy. """
+    names = os.listdir(src)
+    if ignore is not None:
+        ignored = ignore(src, names)
+    else:
+        ignored = ()
+    os.makedirs(dst)
+    for name in names:
+        if name in ignored:
+            continue
+        srcname = os.path.join(src, name)
+        dstname = os.path.join(dst, name)
+        if symlinks and os.path.islink(srcname):
+            os.symlink(os.readlink(srcname), dstname)
+        elif os.path.isdir(srcname):
+            _copytree(srcname, dstname, link, symlinks, ignore)
+        else:
+            _link_or_copy(srcname, dstname, link)
+    shutil.copystat(src, dst)
+
+# seconds between progress messages from rmtree
+_progress_interval = 5
+# files removed by one rmtree job
+_rmtree_batch = 256
+
+def _rmtree(top, ignore_errors=False, onerror=None, jobs=None):
+    """ shutil.rmtree, with the directories listed and the files removed
+    by up to jobs threads at once (by default, one for each CPU). The
+    directories are then removed, deepest first.
+    """
+    def handle(func, name):
+        if ignore_errors:
+            return
+        if onerror is None:
+            raise
+        onerror(func, name, sys.exc_info())
+
+    if os.path.islink(top):
+        try:
+            raise OSError("Cannot call rmtree on a symbolic link")
+        except OSError:
+            handle(os.path.islink, top)
+        return
+
+    # jobs are directories to list, or lists of files to remove
+    pending = Queue.Queue()
+    directories = []
+    failures = []
+    lock = threading.Lock()
+    progress = {'files': 0, 'reported': time.time()}
+
+    def remove_files(names):
+        for name in names:
+            try:
+                os.remove(name)
+            except OSError:
+                handle(os.remove, name)
+        lock.acquire()
+        try:
+            progress['files'] += len(names)
+            now = time.time()
+            if now - progress['reported'] >= _progress_interval:
+                progress['reported'] = now
+                info("rmtree %s: %d files removed so far", top, 
+                     progress['files'])
+        finally:
+            lock.release()
+
+    def list_directory(directory):
+        directories.append(directory)
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            handle(os.listdir, directory)
+            return
+        files = []
+        for name in names:
+            fullname = os.path.join(directory, name)
+            try:
+                mode = os.lstat(fullname).st_mode
+            except OSError:
+                mode = 0
+            if stat.S_ISDIR(mode):
+                pending.put((list_directory, fullname))
+            else:
+                files.append(fullname)
+        for start in range(0, len(files), _rmtree_batch):
+            pending.put((remove_files, files[start:start + _rmtree_batch]))
+
+    def worker():
+        while True:
+            job = pending.get()
+            try:
+                if job is None:
+                    return
+                if not failures:
+                    try:
+                        job[0](job[1])
+                    except Exception:
+                        failures.append(sys.exc_info())
+            finally:
+                pending.task_done()
+
+    if jobs is None:
+        from paver import tasks
+        jobs = tasks._cpu_count()
+    pending.put((list_directory, top))
+    threads = [threading.Thread(target=worker) for i in range(max(1, jobs))]
+    for t in threads:
+        t.setDaemon(True)
+        t.start()
+    pending.join()
+    for t in threads:
+        pending.put(None)
+    for t in threads:
+        t.join()
+    if failures:
+        exc_type, exc_value, exc_tb = failures[0]
+        raise exc_type, exc_value, exc_tb
+
+    directories.sort(key=lambda name: name.count(os.sep), reverse=True)
+    for directory in directories:
+        try:
+            os.rmdir(directory)
+        except OSError:
+            handle(os.rmdir, directory)
+
+def _rmtree_in_background(top, ignore_errors=False, onerror=None, 
+                          jobs=None):
+    """ Moves top into a new hidden directory next to it, and starts a
+    process that removes that directory and goes on after this one
+    exits. Where top can't be moved, it is removed with _rmtree.
+    """
+    parent, name = os.path.split(os.path.abspath(top))
+    try:
+        holder = tempfile.mkdtemp(prefix='.paver-rmtree-', dir=parent)
+    except OSError:
+        return _rmtree(top, ignore_errors, onerror, jobs)
+    try:
+        os.rename(top, os.path.join(holder, name))
+    except OSError:
+        os.rmdir(holder)
+        return _rmtree(top, ignore_errors, onerror, jobs)
+    devnull = open(os.devnull, 'r+b')
+    try:
+        try:
+            subprocess.Popen([sys.executable, '-c', 
+                              'import shutil, sys; '
+                              'shutil.rmtree(sys.argv[1], True)', holder],
+                             stdin=devnull, stdout=devnull, stderr=devnull,
+                             close_fds=os.name != 'nt',
+                             preexec_fn=getattr(os, 'setsid', None))
+        except OSError:
+            _rmtree(holder, ignore_errors, onerror, jobs)
+    finally:
+        devnull.close()
+
+_newlines = [u'\n', u'\r\n', u'\r', u'\x85', u'\u2028']
+
+def _end_line(line, retain):
+    """ line, read by path.iterlines, with its line ending translated
+    to '\n' as path.text() would, or removed if retain is false.
+    """
+    content = line.splitlines()[0]
+    if not retain:
+        return content
+    if line[len(content):] in _newlines:
+        return content + u'\n'
+    return line
+
+def _files_differ(src, dst, checksum):
+    """ Whether the files src and dst (paths) differ, judged by their
+    sizes and then by their hashes or modification times (to the
+    second).
+    """
+    src_stat = os.stat(src)
+    dst_stat = os.stat(dst)
+    if src_stat.st_size != dst_stat.st_size:
+        return True
+    if checksum:
+        return src.read_hash() != dst.read_hash()
+    return int(src_stat.st_mtime) != int(dst_stat.st_mtime)
+
+def _walk_error(errors, message):
+    """ Deals with the exception being handled while walking a tree,
+    as the errors= argument of the tree walkers asks.
+    """
+    if errors == 'strict':
+        raise
+    elif errors == 'warn':
+        warnings.warn("%s: %s" % (message, sys.exc_info()[1]),
+                      TreeWalkWarning)
+
 class path(_base):
     """ Represents a filesystem path.
 
@@ -368,7 +1211,8 @@ class path(_base):
         
         return [p for p in self.listdir(pattern) if p.isfile()]
 
-    def walk(self, pattern=None, errors='strict'):
+    def walk(self, pattern=None, errors='strict', exclude=None, 
+             prune=None):
         """ D.walk() -> iterator over files and subdirs, recursively.
 
         The iterator yields path objects naming each child item of
@@ -382,46 +1226,23 @@ class path(_base):
         error occurs.  The default is 'strict', which causes an
         exception.  The other allowed values are 'warn', which
         reports the error via warnings.warn(), and 'ignore'.
-        """
-        if errors not in ('strict', 'warn', 'ignore'):
-            raise ValueError("invalid errors parameter")
 
-        try:
-            childList = self.listdir()
-        except Exception:
-            if errors == 'ignore':
-                return
-            elif errors == 'warn':
-                warnings.warn(
-                    "Unable to list directory '%s': %s"
-                    % (self, sys.exc_info()[1]),
-                    TreeWalkWarning)
-                return
-            else:
-                raise
-
-        for child in childList:
-            if pattern is None or child.fnmatch(pattern):
+        exclude= and prune= take glob patterns (a list, or a single
+        pattern), such as those read by ignore_patterns(). A pattern
+        without a / is matched against names, any other against the
+        path relative to D, and one ending in / only matches
+        directories. Items that match exclude are skipped (with
+        everything in them), and the directories that match prune are
+        returned but not walked into. For example,
+        ``d.walkfiles('*.py', prune=['.git', 'build/'])``.
+        """
+        for child, relpath, isdir, isfile in self._tree(errors, exclude,
+                                                        prune):
+            if pattern is None or fnmatch.fnmatch(child.name, pattern):
                 yield child
-            try:
-                isdir = child.isdir()
-            except Exception:
-                if errors == 'ignore':
-                    isdir = False
-                elif errors == 'warn':
-                    warnings.warn(
-                        "Unable to access '%s': %s"
-                        % (child, sys.exc_info()[1]),
-                        TreeWalkWarning)
-                    isdir = False
-                else:
-                    raise
-
-            if isdir:
-                for item in child.walk(pattern, errors):
-                    yield item
 
-    def walkdirs(self, pattern=None, errors='strict'):
+    def walkdirs(self, pattern=None, errors='strict', exclude=None,
+                 prune=None):
         """ D.walkdirs() -> iterator over subdirs, recursively.
 
         With the optional 'pattern' argument, this yields only
@@ -433,77 +1254,104 @@ class path(_base):
         error occurs.  The default is 'strict', which causes an
         exception.  The other allowed values are 'warn', which
         reports the error via warnings.warn(), and 'ignore'.
-        """
-        if errors not in ('strict', 'warn', 'ignore'):
-            raise ValueError("invalid errors parameter")
 
-        try:
-            dirs = self.dirs()
-        except Exception:
-            if errors == 'ignore':
-                return
-            elif errors == 'warn':
-                warnings.warn(
-                    "Unable to list directory '%s': %s"
-                    % (self, sys.exc_info()[1]),
-                    TreeWalkWarning)
-                return
-            else:
-                raise
-
-        for child in dirs:
-            if pattern is None or child.fnmatch(pattern):
+        exclude= and prune= work as they do for walk().
+        """
+        for child, relpath, isdir, isfile in self._tree(errors, exclude,
+                                                        prune):
+            if isdir and (pattern is None or 
+                          fnmatch.fnmatch(child.name, pattern)):
                 yield child
-            for subsubdir in child.walkdirs(pattern, errors):
-                yield subsubdir
 
-    def walkfiles(self, pattern=None, errors='strict'):
+    def walkfiles(self, pattern=None, errors='strict', exclude=None,
+                  prune=None):
         """ D.walkfiles() -> iterator over files in D, recursively.
 
         The optional argument, pattern, limits the results to files
         with names that match the pattern.  For example,
         ``mydir.walkfiles('*.tmp')`` yields only files with the .tmp
         extension.
+
+        The errors=, exclude= and prune= arguments work as they do for
+        walk().
+        """
+        for child, relpath, isdir, isfile in self._tree(errors, exclude,
+                                                        prune):
+            if isfile and (pattern is None or 
+                           fnmatch.fnmatch(child.name, pattern)):
+                yield child
+
+    def _tree(self, errors, exclude=None, prune=None):
+        """ Yields (child, relpath, isdir, isfile) for every item below
+        this directory, depth first, each directory just before its
+        contents. relpath is relative to this directory, with / between
+        its parts. A stack of directory listings is used rather than
+        recursion, and the items are listed with _scan. See walk() for
+        exclude and prune, which can also be given as matchers.
         """
         if errors not in ('strict', 'warn', 'ignore'):
             raise ValueError("invalid errors parameter")
-
+        if exclude is not None and not hasattr(exclude, 'match'):
+            exclude = _PatternMatcher(exclude)
+        if prune is not None and not hasattr(prune, 'match'):
+            prune = _PatternMatcher(prune)
+        cls = self.__class__
+        stack = [(self, '', iter(self._scan(errors)))]
+        while stack:
+            directory, relative, entries = stack[-1]
+            try:
+                name, isdir, isfile = entries.next()
+            except StopIteration:
+                stack.pop()
+                continue
+            relpath = relative + name
+            if exclude is not None and exclude.match(relpath, name, isdir):
+                continue
+            child = cls(os.path.join(directory, name))
+            yield child, relpath, isdir, isfile
+            if isdir and (prune is None or 
+                          not prune.match(relpath, name, True)):
+                stack.append((child, relpath + '/',
+                              iter(child._scan(errors))))
+
+    def _scan(self, errors):
+        """ Lists this directory for the tree walkers, as (name, isdir,
+        isfile) for each item. With scandir, the type of most items
+        comes with the listing itself; otherwise each item takes one
+        stat call.
+        """
         try:
-            childList = self.listdir()
-        except Exception:
-            if errors == 'ignore':
-                return
-            elif errors == 'warn':
-                warnings.warn(
-                    "Unable to list directory '%s': %s"
-                    % (self, sys.exc_info()[1]),
-                    TreeWalkWarning)
-                return
+            if _scandir is not None:
+                entries = list(_scandir(self))
             else:
-                raise
-
-        for child in childList:
-            try:
-                isfile = child.isfile()
-                isdir = not isfile and child.isdir()
-            except:
-                if errors == 'ignore':
-                    continue
-                elif errors == 'warn':
-                    warnings.warn(
-                        "Unable to access '%s': %s"
-                        % (self, sys.exc_info()[1]),
-                        TreeWalkWarning)
-                    continue
+                names = os.listdir(self)
+        except Exception:
+            _walk_error(errors, "Unable to list directory '%s'" % self)
+            return []
+        result = []
+        if _scandir is not None:
+            for entry in entries:
+                try:
+                    isdir = entry.is_dir()
+                    isfile = not isdir and entry.is_file()
+                except Exception:
+                    _walk_error(errors, "Unable to access '%s'" % 
+                                os.path.join(self, entry.name))
+                    isdir = isfile = False
+                result.append((entry.name, isdir, isfile))
+        else:
+            for name in names:
+                try:
+                    mode = os.stat(os.path.join(self, name)).st_mode
+                except os.error:
+                    # as with isdir() and isfile(), a broken symbolic
+                    # link is neither
+                    isdir = isfile = False
                 else:
-                    raise
-
-            if isfile:
-                if pattern is None or child.fnmatch(pattern):
-                    yield child
-            elif isdir:
-                for f in child.walkfiles(pattern, errors):
-                    yield f
+                    isdir = stat.S_ISDIR(mode)
+                    isfile = stat.S_ISREG(mode)
+                result.append((name, isdir, isfile))
+        return result
 
     def fnmatch(self, pattern):
         """ Return True if self.name matches the given pattern.
@@ -520,10 +1368,60 @@ class path(_base):
 
         For example, path('/users').glob('*/bin/*') returns a list
         of all the files users have in their bin directories.
+
+        A ** part of the pattern matches any number of directories, so
+        path('docs').glob('**/*.rst') finds the .rst files anywhere
+        under docs. pattern can also be a list of patterns: the tree is
+        walked just once to find the matches for all of them, without
+        looking in directories where nothing can match.
         """
         cls = self.__class__
-        return [cls(s) for s in glob.glob(_base(self / pattern))]
-
+        if isinstance(pattern, basestring):
+            if '**' not in pattern:
+                return [cls(s) for s in glob.glob(_base(self / pattern))]
+            patterns = [pattern]
+        else:
+            patterns = list(pattern)
+        
+        # walk once from the deepest directory that all of the
+        # relative patterns start in; other patterns get walks of
+        # their own
+        groups = {}
+        relative = []
+        shared = None
+        for pattern in patterns:
+            parts = pattern.replace(os.sep, '/').split('/')
+            fixed = 0
+            while fixed < len(parts) - 1 and not glob.has_magic(parts[fixed]):
+                fixed = fixed + 1
+            if parts[0] == '' or '..' in parts[:fixed]:
+                base = '/'.join(parts[:fixed]) or '/'
+                groups.setdefault(base, []).append('/'.join(parts[fixed:]))
+                continue
+            relative.append(parts)
+            if shared is None:
+                shared = parts[:fixed]
+            else:
+                common = 0
+                while common < min(len(shared), fixed) and \
+                        shared[common] == parts[common]:
+                    common = common + 1
+                shared = shared[:common]
+        for parts in relative:
+            groups.setdefault('/'.join(shared), []).append(
+                '/'.join(parts[len(shared):]))
+        
+        result = []
+        for base, group in groups.items():
+            top = self / base
+            if not top.isdir():
+                continue
+            matcher = _GlobMatcher(group)
+            for child, relpath, isdir, isfile in top._tree('ignore', 
+                                                            prune=matcher):
+                if matcher.matches(relpath):
+                    result.append(child)
+        return result
 
     # --- Reading or writing an entire file at once.
 
@@ -540,12 +1438,67 @@ class path(_base):
         finally:
             f.close()
 
-    def write_bytes(self, bytes, append=False):
+    def iterchunks(self, size=65536, encoding=None, errors='strict'):
+        """ Iterate over the contents of this file, size bytes at a time.
+
+        Without an encoding, the chunks are 8-bit strings of the bytes
+        as they are in the file. With one, each chunk holds the unicode
+        characters decoded from (about) size bytes; errors is as for
+        text(). Only one chunk is held in memory at a time.
+        """
+        f = self.open('rb')
+        try:
+            if encoding is not None:
+                f = codecs.getreader(encoding)(f, errors)
+            while True:
+                chunk = f.read(size)
+                if not chunk:
+                    break
+                yield chunk
+        except:
+            f.close()
+            raise
+        f.close()
+
+    def map(self):
+        """ Map this file into memory, read-only, and return the mmap
+        object, which works like a string (it can be sliced, or searched
+        with find() or regular expressions) without the file being read
+        in. Close it when done with it.
+
+        An empty file, which can't be mapped, gives an empty string, and
+        so does any file where mmap isn't available, in which case the
+        contents are read in as with bytes().
+        """
+        if mmap is None:
+            return self.bytes()
+        f = self.open('rb')
+        try:
+            if os.fstat(f.fileno()).st_size == 0:
+                return ''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+    def write_bytes(self, bytes, append=False, if_changed=False):
         """ Open this file and write the given bytes to it.
 
         Default behavior is to overwrite any existing file.
         Call p.write_bytes(bytes, append=True) to append instead.
+
+        With if_changed=True, the file is left alone (modification time
+        and all) if it already holds the given bytes. Otherwise, the
+        bytes are written to a temporary file that then replaces this
+        one, so there is never a half-written file to be seen. Returns
+        whether the file was written.
         """
+        if if_changed:
+            if append:
+                raise ValueError("if_changed can't be used with append")
+            if self._has_content(bytes):
+                return False
+            self._write_atomically(bytes)
+            return True
         if append:
             mode = 'ab'
         else:
@@ -555,6 +1508,53 @@ class path(_base):
             f.write(bytes)
         finally:
             f.close()
+        return True
+
+    def _has_content(self, bytes):
+        """ Whether this file holds exactly the given bytes. The sizes
+        are compared first, and then the contents a block at a time.
+        """
+        try:
+            if os.path.getsize(self) != len(bytes):
+                return False
+            f = self.open('rb')
+        except (IOError, OSError):
+            return False
+        try:
+            offset = 0
+            while True:
+                block = f.read(65536)
+                if not block:
+                    return offset == len(bytes)
+                if block != bytes[offset:offset + len(block)]:
+                    return False
+                offset += len(block)
+        finally:
+            f.close()
+
+    def _write_atomically(self, bytes):
+        # like a plain write, this goes through symbolic links
+        target = os.path.realpath(self)
+        fd, tmpname = _temp_beside(target)
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.write(bytes)
+            finally:
+                f.close()
+            # mkstemp makes files only the owner can read
+            try:
+                mode = stat.S_IMODE(os.stat(target).st_mode)
+            except OSError:
+                umask = os.umask(0)
+                os.umask(umask)
+                mode = 0666 & ~umask
+            os.chmod(tmpname, mode)
+            _rename_over(tmpname, target)
+        except:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
 
     def text(self, encoding=None, errors='strict'):
         r""" Open this file, read it in, return the content as a string.
@@ -593,7 +1593,7 @@ class path(_base):
                      .replace(u'\x85', u'\n')
                      .replace(u'\u2028', u'\n'))
 
-    def write_text(self, text, encoding=None, errors='strict', linesep=os.linesep, append=False):
+    def write_text(self, text, encoding=None, errors='strict', linesep=os.linesep, append=False, if_changed=False):
         r""" Write the given text to this file.
 
         The default behavior is to overwrite any existing file;
@@ -624,6 +1624,10 @@ class path(_base):
             the file already exists (True: append to the end of it;
             False: overwrite it.)  The default is False.
 
+          - if_changed - keyword argument - bool - Only write the file
+            if its contents would change, as for write_bytes(), and
+            return whether it was written.
+
 
         --- Newline handling.
 
@@ -680,7 +1684,7 @@ class path(_base):
                             .replace('\r', '\n'))
                 bytes = text.replace('\n', linesep)
 
-        self.write_bytes(bytes, append)
+        return self.write_bytes(bytes, append, if_changed)
 
     def lines(self, encoding=None, errors='strict', retain=True):
         r""" Open this file, read all lines, return them in a list.
@@ -697,19 +1701,42 @@ class path(_base):
                 translated to '\n'.  If false, newline characters are
                 stripped off.  Default is True.
 
-        This uses 'U' mode in Python 2.3 and later.
+        This uses 'U' mode in Python 2.3 and later. Use iterlines() to
+        go through the lines without reading them all in.
+        """
+        return list(self.iterlines(encoding, errors, retain))
+
+    def iterlines(self, encoding=None, errors='strict', retain=True):
+        r""" Iterate over the lines of this file, reading it a block at a
+        time, so that only one block and the current line are held in
+        memory. The arguments are as for lines(), and newlines are
+        translated in the same way.
         """
-        if encoding is None and retain:
+        if encoding is None:
             f = self.open(_textmode)
             try:
-                return f.readlines()
-            finally:
+                for line in f:
+                    if not retain and line.endswith('\n'):
+                        line = line[:-1]
+                    yield line
+            except:
                 f.close()
-        else:
-            return self.text(encoding, errors).splitlines(retain)
+                raise
+            f.close()
+            return
+        pending = u''
+        for chunk in self.iterchunks(encoding=encoding, errors=errors):
+            lines = (pending + chunk).splitlines(True)
+            # the last line may go on in the next chunk (even if it
+            # ends with '\r', which could be the start of '\r\n')
+            pending = lines.pop()
+            for line in lines:
+                yield _end_line(line, retain)
+        if pending:
+            yield _end_line(pending, retain)
 
     def write_lines(self, lines, encoding=None, errors='strict',
-                    linesep=os.linesep, append=False):
+                    linesep=os.linesep, append=False, if_changed=False):
         r""" Write the given lines of text to this file.
 
         By default this overwrites any existing file at this path.
@@ -741,12 +1768,20 @@ class path(_base):
         you specify with the encoding= parameter, the result is
         mixed-encoding data, which can really confuse someone trying
         to read the file later.
+
+        Use if_changed=True to only write the file if its contents
+        would change, as for write_bytes().  This returns whether the
+        file was written.
         """
-        if append:
-            mode = 'ab'
+        if if_changed:
+            if append:
+                raise ValueError("if_changed can't be used with append")
+            from cStringIO import StringIO
+            f = StringIO()
+        elif append:
+            f = self.open('ab')
         else:
-            mode = 'wb'
-        f = self.open(mode)
+            f = self.open('wb')
         try:
             for line in lines:
                 isUnicode = isinstance(line, unicode)
@@ -770,25 +1805,69 @@ class path(_base):
                         encoding = sys.getdefaultencoding()
                     line = line.encode(encoding, errors)
                 f.write(line)
+            if if_changed:
+                return self.write_bytes(f.getvalue(), if_changed=True)
         finally:
             f.close()
+        return True
 
     def read_md5(self):
         """ Calculate the md5 hash for this file.
 
-        This reads through the entire file.
+        This reads through the entire file, unless its hash is cached
+        (see read_hash).
         """
-        f = self.open('rb')
-        try:
-            m = md5()
-            while True:
-                d = f.read(8192)
-                if not d:
-                    break
-                m.update(d)
-        finally:
-            f.close()
-        return m.digest()
+        return binascii.unhexlify(self.read_hash('md5'))
+
+    def read_hash(self, algo='md5'):
+        """ Calculate a hash of this file, as a string of hex digits.
+
+        algo is the name of a hashlib algorithm, such as 'sha1' or
+        'sha256'. The hashes are kept in file_hashes in Paver's cache
+        directory, by device, inode, size and modification time, so
+        a file is only read again when it changes (even in later
+        runs). The hashes of files changed in the last couple of
+        seconds are not kept, as those files could change again
+        without getting a new modification time.
+        """
+        st = os.stat(self)
+        key = _hash_key(self, st)
+        stamp = (st.st_size, st.st_mtime)
+        digest = _hash_cache.get(key, stamp, algo)
+        if digest is None:
+            digest = _hash_file(self, algo)
+            if time.time() - st.st_mtime > _racy_seconds:
+                # make sure that it didn't change while it was read
+                after = os.stat(self)
+                if (after.st_size, after.st_mtime) == stamp:
+                    _hash_cache.set(key, stamp, algo, digest)
+        return digest
+
+    def hash_tree(self, pattern=None, exclude=None, prune=None, 
+                  algo='md5', jobs=None):
+        """ Calculate a fingerprint of the contents of this directory, as
+        a TreeHash.
+
+        The files (those whose names match pattern, if it is given)
+        are hashed with read_hash, by up to jobs threads at once (by
+        default, one for each CPU). The hash of each directory covers
+        the names and hashes of what is in it, and directories without
+        any of the files are left out. exclude and prune work as they
+        do for walk().
+        """
+        files = []
+        for child, relpath, isdir, isfile in self._tree('strict', exclude,
+                                                        prune):
+            if isfile and (pattern is None or 
+                           fnmatch.fnmatch(child.name, pattern)):
+                files.append((relpath, child))
+
+        digests = {}
+        def hash_file(item):
+            relpath, child = item
+            digests[relpath] = child.read_hash(algo)
+        _run_threaded(hash_file, files, jobs)
+        return TreeHash(digests, algo)
 
     # --- Methods for querying the filesystem.
 
@@ -969,21 +2048,147 @@ class path(_base):
 
     # --- High-level functions from shutil
     
-    def copy(self, dst):
-        dry("copy %s %s" % (self, dst), shutil.copy, self, dst)
-        
+    def copy(self, dst, link=None):
+        """ Copy this file to dst, as shutil.copy does.
+
+        With link='reflink', the copy is made as a copy-on-write clone
+        where the file system supports that; with link='hard', as a hard
+        link (so changes to either file show in both) where possible;
+        and with link='auto', as a clone or else a hard link. Otherwise,
+        the file is copied. Returns the method that was used: 'reflink',
+        'hard' or 'copy'.
+        """
+        if link is None:
+            dry("copy %s %s" % (self, dst), shutil.copy, self, dst)
+            return 'copy'
+        if os.path.isdir(dst):
+            dst = os.path.join(dst, self.name)
+        return dry("copy %s %s (link=%s)" % (self, dst, link),
+                   _link_or_copy, self, dst, link)
+
     def copytree(self, dst, *args, **kw):
-        dry("copytree %s %s" % (self, dst), shutil.copytree, 
-                                        self, dst, *args, **kw)
+        """ Copy this directory to dst, as shutil.copytree does. The
+        keyword argument link makes the copies of the files as for
+        copy().
+        """
+        link = kw.pop('link', None)
+        if link is None:
+            dry("copytree %s %s" % (self, dst), shutil.copytree, 
+                                            self, dst, *args, **kw)
+        else:
+            dry("copytree %s %s (link=%s)" % (self, dst, link), _copytree,
+                self, dst, link, *args, **kw)
     
+    def sync_to(self, dst, delete=False, exclude=None, prune=None,
+                checksum=False, jobs=None, link=None):
+        """ Bring the directory dst up to date with this one, copying
+        only the files that are missing from it or differ.
+
+        Files differ if their sizes or modification times (to the
+        second) do, or with checksum=True, if their sizes or hashes do.
+        Copies keep the permission bits and times of the originals,
+        and are made on up to jobs threads at once (by default, one for
+        each CPU), inside the kernel where it supports that. Anything
+        in dst that isn't in this directory is deleted if delete is
+        true. exclude and prune work as they do for walk(), and apply
+        to both directories, so excluded files in dst are kept. link
+        says how the copies are made, as for copy().
+
+        Returns two lists holding the paths (relative to dst, with /
+        between the parts) of the files copied and the items deleted.
+        In a dry run, nothing is changed, and the lists say what would
+        have been.
+        """
+        if link not in _link_modes:
+            raise ValueError("invalid link parameter: %r" % (link,))
+        dst = self.__class__(dst)
+        sources = {}
+        directories = []
+        for child, relpath, isdir, isfile in self._tree('strict', exclude,
+                                                        prune):
+            if isdir:
+                directories.append(relpath)
+            elif isfile:
+                sources[relpath] = child
+        targets = {}
+        if dst.isdir():
+            for child, relpath, isdir, isfile in dst._tree('strict', exclude,
+                                                           prune):
+                targets[relpath] = isdir and not child.islink()
+
+        wanted = dict.fromkeys(directories, True)
+        wanted.update(dict.fromkeys(sources, False))
+        removed = {}
+        for relpath in sorted(targets):
+            parent = _split_relpath(relpath)[0]
+            while parent and parent not in removed:
+                parent = _split_relpath(parent)[0]
+            if parent:
+                # it goes along with its directory
+                del targets[relpath]
+                continue
+            if wanted.get(relpath, targets[relpath]) != targets[relpath]:
+                removed[relpath] = True
+            elif delete and relpath not in wanted:
+                removed[relpath] = True
+
+        copied = []
+        def compare(relpath):
+            if (relpath not in targets or relpath in removed or
+                _files_differ(sources[relpath], dst / relpath, checksum)):
+                copied.append(relpath)
+        _run_threaded(compare, sources.keys(), jobs)
+        copied.sort()
+        missing = [relpath for relpath in directories
+                   if relpath in removed or not targets.get(relpath)]
+        removed = sorted(removed)
+
+        def sync():
+            for relpath in removed:
+                item = dst / relpath
+                if targets[relpath]:
+                    shutil.rmtree(item)
+                else:
+                    os.remove(item)
+            if not dst.isdir():
+                os.makedirs(dst)
+            for relpath in missing:
+                os.mkdir(dst / relpath)
+            def copy(relpath):
+                _link_or_copy(sources[relpath], dst / relpath, link)
+            _run_threaded(copy, copied, jobs)
+        if copied or removed or missing or not dst.isdir():
+            dry("sync_to %s %s (%d to copy, %d to delete)" % 
+                (self, dst, len(copied), len(removed)), sync)
+        return copied, removed
+
     if hasattr(shutil, 'move'):
         def move(self, dst):
             dry("move %s %s" % (self, dst), shutil.move, self, dst)
     
-    def rmtree(self, *args, **kw):
-        if self.exists():
-            dry("rmtree %s %s %s" % (self, args, kw), shutil.rmtree, 
-                                        self, *args, **kw)
+    def rmtree(self, ignore_errors=False, onerror=None, jobs=None,
+               background=False):
+        """ Remove this directory and everything in it, if it exists.
+
+        The directories are listed and the files removed by up to jobs
+        threads at once (by default, one for each CPU), and progress is
+        logged every few seconds. Symbolic links are removed, not
+        followed. ignore_errors and onerror work as they do for
+        shutil.rmtree.
+
+        With background=True, the directory is moved out of the way (to
+        a hidden directory next to it) and removed by a separate process
+        that carries on after Paver exits, so this returns at once.
+        Errors in that process are ignored.
+        """
+        if not self.exists():
+            return
+        if background:
+            dry("rmtree %s (in the background)" % self, 
+                _rmtree_in_background, self, ignore_errors, onerror, jobs)
+        else:
+            dry("rmtree %s" % self, _rmtree, self, ignore_errors, onerror,
+                jobs)
 
 
     # --- Special stuff from os
@@ -996,4 +2201,4 @@ class path(_base):
         def startfile(self):
             os.startfile(self)
 
-from paver.easy import dry
+from paver.easy import dry, debug, info
@@ -3,8 +3,10 @@
 import re
 import os
 import sys
+import atexit
 import distutils
-from fnmatch import fnmatchcase
+import distutils.command
+from fnmatch import fnmatchcase, translate
 from distutils.util import convert_path
 from distutils import log
 try:
@@ -14,6 +16,11 @@ except ImportError:
 from distutils.errors import DistutilsModuleError
 _Distribution = dist.Distribution
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 from distutils import debug
 # debug.DEBUG = True
 
@@ -42,6 +49,26 @@ standard_exclude = ('*.py', '*.pyc', '*~', '.*', '*.bak', '*.swp*')
 standard_exclude_directories = ('.*', 'CVS', '_darcs', './build',
                                 './dist', 'EGG-INFO', '*.egg-info')
 
+def _exclude_matcher(patterns):
+    """Compiles the exclude patterns of find_package_data, which match
+    either the name (with wildcards) or, ignoring case, the whole path.
+    Returns a function of the name and path that gives the first
+    pattern that matches, or None."""
+    patterns = list(patterns)
+    if not patterns:
+        return lambda name, fn: None
+    names = re.compile("|".join(["(?:%s)" % translate(pattern)
+                                 for pattern in patterns]))
+    paths = set([pattern.lower() for pattern in patterns])
+    def match(name, fn):
+        if not names.match(name) and fn.lower() not in paths:
+            return None
+        for pattern in patterns:
+            if (fnmatchcase(name, pattern)
+                or fn.lower() == pattern.lower()):
+                return pattern
+    return match
+
 def find_package_data(
     where='.', package='',
     exclude=standard_exclude,
@@ -78,23 +105,20 @@ def find_package_data(
     """
 
     out = {}
+    excluded_file = _exclude_matcher(exclude)
+    excluded_directory = _exclude_matcher(exclude_directories)
     stack = [(convert_path(where), '', package, only_in_packages)]
     while stack:
         where, prefix, package, only_in_packages = stack.pop(0)
         for name in os.listdir(where):
             fn = os.path.join(where, name)
             if os.path.isdir(fn):
-                bad_name = False
-                for pattern in exclude_directories:
-                    if (fnmatchcase(name, pattern)
-                        or fn.lower() == pattern.lower()):
-                        bad_name = True
-                        if show_ignored:
-                            print >> sys.stderr, (
-                                "Directory %s ignored by pattern %s"
-                                % (fn, pattern))
-                        break
-                if bad_name:
+                pattern = excluded_directory(name, fn)
+                if pattern is not None:
+                    if show_ignored:
+                        print >> sys.stderr, (
+                            "Directory %s ignored by pattern %s"
+                            % (fn, pattern))
                     continue
                 if os.path.isfile(os.path.join(fn, '__init__.py')):
                     if not package:
@@ -106,24 +130,31 @@ def find_package_data(
                     stack.append((fn, prefix + name + '/', package, only_in_packages))
             elif package or not only_in_packages:
                 # is a file
-                bad_name = False
-                for pattern in exclude:
-                    if (fnmatchcase(name, pattern)
-                        or fn.lower() == pattern.lower()):
-                        bad_name = True
-                        if show_ignored:
-                            print >> sys.stderr, (
-                                "File %s ignored by pattern %s"
-                                % (fn, pattern))
-                        break
-                if bad_name:
+                pattern = excluded_file(name, fn)
+                if pattern is not None:
+                    if show_ignored:
+                        print >> sys.stderr, (
+                            "File %s ignored by pattern %s"
+                            % (fn, pattern))
                     continue
                 out.setdefault(package, []).append(prefix+name)
     return out
 
 class DistutilsTask(tasks.Task):
-    def __init__(self, distribution, command_name, command_class):
-        name_sections = str(command_class).split(".")
+    """A distutils/setuptools command presented as a Task. The command
+    class is only imported when the task is run or its options are
+    needed; until then, all that is known is the command name (and the
+    entry point that provides it, if any)."""
+    def __init__(self, distribution, command_name, command_class=None,
+                 entry_point=None):
+        if command_class is not None:
+            name_sections = str(command_class).split(".")
+        elif entry_point is not None:
+            name_sections = entry_point.module_name.split(".") + \
+                            list(entry_point.attrs)
+        else:
+            name_sections = ["distutils", "command", command_name, 
+                             command_name]
         if name_sections[-2] == name_sections[-1]:
             del name_sections[-2]
         self.name = ".".join(name_sections)
@@ -131,14 +162,42 @@ class DistutilsTask(tasks.Task):
         self.distribution = distribution
         self.command_name = command_name
         self.shortname = _get_shortname(command_name)
-        self.command_class = command_class
+        self.entry_point = entry_point
+        self._command_class = command_class
         self.option_names = set()
         self.needs = []
-        self.user_options = command_class.user_options
-        # Parse distutils config files.
-        distribution.parse_config_files()
+        
+    def _get_command_class(self):
+        if self._command_class is None:
+            if self.entry_point is not None:
+                # don't require extras, we're not running yet
+                command_class = self.entry_point.load(False)
+                self.distribution.cmdclass[self.command_name] = command_class
+            else:
+                command_class = self.distribution.get_command_class(
+                    self.command_name)
+            self._command_class = command_class
+        return self._command_class
+    
+    command_class = property(_get_command_class)
+    
+    @property
+    def user_options(self):
+        try:
+            return self.command_class.user_options
+        except Exception:
+            if self.entry_point is None:
+                raise
+            # as with the description, a broken command shouldn't stop 
+            # the other tasks from being used
+            tasks.environment.info("Could not load entry point: %s", 
+                                   self.entry_point)
+            return []
         
     def __call__(self, *args, **kw):
+        # make sure it's our command class that gets run
+        self.command_class
+        _parse_config_files(self.distribution)
         options = tasks.environment.options.get(self.shortname, {})
         opt_dict = self.distribution.get_option_dict(self.command_name)
         for (name, value) in options.items():
@@ -147,7 +206,105 @@ class DistutilsTask(tasks.Task):
         
     @property
     def description(self):
-        return self.command_class.description
+        key = self._description_key()
+        if key is not None and self._command_class is None:
+            description = _description_cache.get(key)
+            if description is not None:
+                return description
+        try:
+            description = self.command_class.description
+        except Exception:
+            # on the Mac, at least, installing from the tarball
+            # via zc.buildout fails due to a problem in the
+            # py2app command
+            tasks.environment.info("Could not load command %s", self.name)
+            return ""
+        if key is not None:
+            _description_cache[key] = description
+        return description
+    
+    def _description_key(self):
+        if self.entry_point is not None:
+            dist = self.entry_point.dist
+            if dist is None:
+                return None
+            return (dist.project_name, dist.version, self.command_name,
+                    self.name)
+        if self._command_class is None:
+            return ("Python", sys.version.split()[0], self.command_name,
+                    self.name)
+        return None
+
+class _DescriptionCache(object):
+    """Descriptions of distutils commands, so that 'paver help' doesn't
+    need to import every command. The entries are keyed by the version of
+    the distribution providing the command, and the cache is saved to
+    distutils_descriptions in the user's paver cache directory when
+    Paver exits."""
+    def __init__(self):
+        self._entries = None
+        self._dirty = False
+    
+    def _get_filename(self):
+        return os.path.join(tasks._user_cache_dir(), 
+                            "distutils_descriptions")
+    
+    def _load(self):
+        if self._entries is None:
+            try:
+                f = open(self._get_filename(), "rb")
+                try:
+                    self._entries = pickle.load(f)
+                finally:
+                    f.close()
+            except Exception:
+                self._entries = {}
+        return self._entries
+    
+    def get(self, key):
+        return self._load().get(key)
+    
+    def __setitem__(self, key, description):
+        entries = self._load()
+        if entries.get(key) == description:
+            return
+        entries[key] = description
+        if not self._dirty:
+            self._dirty = True
+            atexit.register(self.save)
+    
+    def save(self):
+        from paver.path import _temp_beside, _rename_over
+        if not self._dirty:
+            return
+        filename = self._get_filename()
+        try:
+            dirname = os.path.dirname(filename)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            # another Paver may be saving at the same time
+            fd, tmpname = _temp_beside(filename)
+            try:
+                f = os.fdopen(fd, "wb")
+                try:
+                    pickle.dump(self._entries, f, 2)
+                finally:
+                    f.close()
+                _rename_over(tmpname, filename)
+            except:
+                os.remove(tmpname)
+                raise
+        except (IOError, OSError), e:
+            tasks.environment.debug("Could not save %s: %s", filename, e)
+        self._dirty = False
+
+_description_cache = _DescriptionCache()
+
+def _parse_config_files(distribution):
+    """Parses the distutils config files, once per distribution."""
+    if not getattr(distribution, "_paver_config_parsed", False):
+        distribution.parse_config_files()
+        distribution._paver_config_parsed = True
         
 def _get_shortname(taskname):
     dotindex = taskname.rfind(".")
@@ -169,19 +326,17 @@ class DistutilsTaskFinder(object):
         
     def get_tasks(self):
         dist = _get_distribution()
+        commands = {}
+        for command_name in distutils.command.__all__:
+            commands[command_name] = DistutilsTask(dist, command_name)
         if has_setuptools:
             for ep in pkg_resources.iter_entry_points('distutils.commands'):
-                try:
-                    cmdclass = ep.load(False) # don't require extras, we're not running
-                    dist.cmdclass[ep.name] = cmdclass
-                except:
-                    # on the Mac, at least, installing from the tarball
-                    # via zc.buildout fails due to a problem in the
-                    # py2app command
-                    tasks.environment.info("Could not load entry point: %s", ep)
-        dist.get_command_list()
-        return set(DistutilsTask(dist, key, value) 
-            for key, value in dist.cmdclass.items())
+                commands[ep.name] = DistutilsTask(dist, ep.name, 
+                                                  entry_point=ep)
+        for command_name, command_class in dist.cmdclass.items():
+            commands[command_name] = DistutilsTask(dist, command_name, 
+                                                   command_class)
+        return set(commands.values())
 
 def _get_distribution():
     try:
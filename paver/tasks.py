@@ -1,14 +1,42 @@
 import sys
 import os
+import atexit
+import collections
+import gzip
 import os.path
 import optparse
 import types
+import imp
+import marshal
 import inspect
 import itertools
 import traceback
+import threading
+import time
+import socket
+import glob
+import tarfile
+import tempfile
+import Queue
+import zlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    from hashlib import md5
+except ImportError:
+    # compatibility for versions before 2.5
+    import md5
+    md5 = md5.new
 
 VERSION = "1.0.2"
 
+# guards the creation of Environment.stamps, which tasks run by -j can
+# first ask for at the same time
+_stamps_lock = threading.Lock()
+
 class PavementError(Exception):
     """Exception that represents a problem in the pavement.py file
     rather than the process of running a build."""
@@ -23,15 +51,32 @@ class Environment(object):
     _task_in_progress = None
     _task_output = None
     _all_tasks = None
+    _shortname_index = None
+    _stamps = None
     _dry_run = False
     verbose = False
     interactive = False
     quiet = False
+    jobs = 1
+    cache_dir = None
+    daemon = False
+    no_daemon = False
+    watch = False
+    timings = False
+    trace_file = None
+    profile = None
+    _timings = None
+    history = None
+    _log_json = None
     _file = "pavement.py"
     
     def __init__(self, pavement=None):
         self.pavement = pavement
         self.task_finders = []
+        # objects with emit(record) and close() methods, which are sent 
+        # a LogRecord for every message logged, whatever the log level
+        self.log_sinks = []
+        self._current = threading.local()
         try:
             # for the time being, at least, tasks.py can be used on its
             # own!
@@ -52,22 +97,41 @@ class Environment(object):
         self._log(3, message, args)
     
     def _log(self, level, message, args):
-        # This conditional fixes an issue which arises if the message contains
-        # formatting directives but no args are provided.
-        if args:
-            output = message % args
-        else:
-            output = message
-
+        # the message is only formatted when something needs it, and 
+        # then right away, so that later changes to the arguments don't 
+        # show up in it
+        record = LogRecord(level, message, args, 
+            getattr(self._current, "task", None) or self._task_in_progress)
+        if self._task_output is not None or self.log_sinks:
+            record.getMessage()
         if self._task_output is not None:
-            self._task_output.append(output)
+            self._task_output.append(record)
         if level > 2 or (level > 1 and not self.quiet) or \
             self.verbose:
-            self._print(output)
+            self._print(record.getMessage())
+        for sink in self.log_sinks:
+            sink.emit(record)
     
     def _print(self, output):
         print output
     
+    def _set_log_json(self, filename):
+        if filename == self._log_json:
+            return
+        for sink in self.log_sinks[:]:
+            if isinstance(sink, JSONLinesSink) and \
+                    sink.filename == self._log_json:
+                sink.close()
+                self.log_sinks.remove(sink)
+        self._log_json = filename
+        if filename:
+            self.log_sinks.append(JSONLinesSink(filename))
+    
+    def _get_log_json(self):
+        return self._log_json
+    
+    log_json = property(_get_log_json, _set_log_json)
+    
     def _exit(self, code):
         sys.exit(1)
 
@@ -108,15 +172,18 @@ class Environment(object):
                     break
 
         # try to look up by full name
+        if not task:
+            task = _registry.get(taskname)
+            if task is not None and not _is_registered(task):
+                task = None
         if not task:
             task = _import_task(taskname)
             
         # if there's nothing by full name, look up by
         # short name
         if not task:
-            all_tasks = self.get_tasks()
-            matches = [t for t in all_tasks
-                        if t.shortname == taskname]
+            self.get_tasks()
+            matches = self._shortname_index.get(taskname, [])
             if len(matches) > 1:
                 matched_names = [t.name for t in matches]
                 raise BuildFailure("Ambiguous task name %s (%s)" %
@@ -129,7 +196,24 @@ class Environment(object):
         task = self.get_task(task_name)
         task()
     
-    def _run_task(self, task_name, needs, func):
+    def _get_stamps(self):
+        _stamps_lock.acquire()
+        try:
+            if self._stamps is None:
+                if self.pavement_file:
+                    basedir = os.path.dirname(
+                        os.path.abspath(self.pavement_file))
+                else:
+                    basedir = os.getcwd()
+                self._stamps = _StampDatabase(os.path.join(basedir, 
+                                                           ".paver_stamps"))
+            return self._stamps
+        finally:
+            _stamps_lock.release()
+    
+    stamps = property(_get_stamps)
+    
+    def _run_task(self, task_name, needs, func, task=None):
         (funcargs, varargs, varkw, defaults) = inspect.getargspec(func)
         kw = dict()
         for i in xrange(0, len(funcargs)):
@@ -149,23 +233,34 @@ class Environment(object):
         
         if not self._task_in_progress:
             self._task_in_progress = task_name
-            self._task_output = []
+            self._task_output = _TaskOutput()
             running_top_level = True
         else:
             running_top_level = False
         def do_task():
+            outer_task = getattr(self._current, "task", None)
+            self._current.task = task_name
             self.info("---> " + task_name)
-            for req in needs:
-                task = self.get_task(req)
-                if not task:
-                    raise PavementError("Requirement %s for task %s not found" %
-                        (req, task_name))
-                if not isinstance(task, Task):
-                    raise PavementError("Requirement %s for task %s is not a Task"
-                        % (req, task_name))
-                if not task.called:
-                    task()
-            return func(**kw)
+            timing = self._start_timing(task_name)
+            start = None
+            status = "failed"
+            try:
+                self._run_needs(task_name, needs)
+                if timing is not None:
+                    timing.needs_done()
+                start = time.time()
+                status, retval = self._call_task_function(task_name, func, 
+                                                          kw, task)
+                return retval
+            finally:
+                if timing is not None:
+                    self._finish_timing(timing)
+                # a dry run takes no time, which would spoil the averages
+                if self.history is not None and start is not None and \
+                    not self.dry_run:
+                    self.history.record(task_name, task, start, time.time(),
+                                        status)
+                self._current.task = outer_task
         if running_top_level:
             try:
                 return do_task()
@@ -175,7 +270,13 @@ class Environment(object):
 Captured Task Output:
 ---------------------
 """)
-                self._print("\n".join(self._task_output))
+                output = self._task_output
+                output.keep()
+                if output.filename:
+                    self._print("(only the last %d lines are shown here; "
+                                "all of the output is in %s)\n" 
+                                % (len(output.lines()), output.filename))
+                self._print("\n".join(output.lines()))
                 if isinstance(e, BuildFailure):
                     self._print("\nBuild failed running %s: %s" % 
                                 (self._task_in_progress, e))
@@ -187,28 +288,861 @@ Captured Task Output:
         else:
             return do_task()
     
+    def _run_needs(self, task_name, needs):
+        if self.jobs > 1:
+            self._run_needs_in_parallel(task_name, needs)
+        else:
+            for req in needs:
+                needed = self._get_needed_task(task_name, req)
+                if not needed.called:
+                    needed()
+    
+    def _call_task_function(self, task_name, func, kw, task):
+        """Calls the task's function, unless the task is up to date or
+        its outputs can be restored from the cache. Returns how the task
+        was run ("ok", "skipped" or "cached") along with its result."""
+        if task is None or not (task.inputs or task.outputs):
+            return "ok", self._call_function(task_name, func, kw)
+        state = self.stamps.state_of(task)
+        if self.stamps.is_current(task, state):
+            self.info("Skipping %s: inputs and options are unchanged" 
+                      % task_name)
+            if not self.dry_run:
+                # remember new mtimes of files whose content is the same
+                self.stamps.record(task, state)
+            return "skipped", None
+        cache = None
+        if self.cache_dir and task.outputs and not self.dry_run:
+            cache = _ResultCache(self.cache_dir)
+            key = cache.key_for(task, state)
+            if cache.restore(key):
+                self.info("Restored outputs of %s from the cache" 
+                          % task_name)
+                self.stamps.record(task, state)
+                return "cached", None
+        retval = self._call_function(task_name, func, kw)
+        if not self.dry_run:
+            self.stamps.record(task, state)
+        if cache is not None:
+            cache.store(key, task.outputs)
+        return "ok", retval
+    
+    def _call_function(self, task_name, func, kw):
+        shortname = task_name.split(".")[-1]
+        if self.profile not in (task_name, shortname):
+            return func(**kw)
+        try:
+            import cProfile as profile
+        except ImportError:
+            import profile
+        import pstats
+        from StringIO import StringIO
+        profiler = profile.Profile()
+        try:
+            return profiler.runcall(func, **kw)
+        finally:
+            stats_file = shortname + ".pstats"
+            profiler.dump_stats(stats_file)
+            output = StringIO()
+            stats = pstats.Stats(stats_file, stream=output)
+            stats.sort_stats("cumulative").print_stats(25)
+            self.info("Profile of %s (saved in %s):\n%s", task_name, 
+                      stats_file, output.getvalue())
+    
+    def _start_timing(self, task_name):
+        if not (self.timings or self.trace_file):
+            return None
+        if self._timings is None:
+            self._timings = []
+            self._timing_stack = threading.local()
+        stack = getattr(self._timing_stack, "tasks", None)
+        if stack is None:
+            stack = self._timing_stack.tasks = []
+        if stack:
+            parent = stack[-1].name
+        else:
+            parent = getattr(self._timing_stack, "parent", None)
+        timing = _TaskTiming(task_name, parent, len(stack))
+        stack.append(timing)
+        return timing
+    
+    def _finish_timing(self, timing):
+        timing.finish()
+        self._timing_stack.tasks.pop()
+        self._timings.append(timing)
+    
+    def _report_timings(self):
+        """Prints the time each task took, slowest first, and writes the
+        Chrome trace file if one was asked for."""
+        if not self._timings:
+            return
+        timings = sorted(self._timings, key=lambda t: t.own_time, 
+                         reverse=True)
+        lines = ["", "Task timings (slowest first):",
+                 "%9s %9s %9s %10s  %s" % ("own", "total", "cpu", "max rss",
+                                           "task")]
+        for timing in timings:
+            if timing.max_rss is None:
+                max_rss = "-"
+            else:
+                max_rss = "%.1fMB" % (timing.max_rss / 1024.0)
+            line = "%8.3fs %8.3fs %8.3fs %10s  %s" % (timing.own_time, 
+                timing.total_time, timing.cpu_time, max_rss, timing.name)
+            if timing.parent:
+                line += " (needed by %s)" % timing.parent
+            lines.append(line)
+        self._print("\n".join(lines))
+        if self.trace_file:
+            _write_chrome_trace(self.trace_file, self._timings)
+            self._print("Wrote trace of the tasks to %s" % self.trace_file)
+        self._timings = []
+    
+    def _get_needed_task(self, task_name, req):
+        task = self.get_task(req)
+        if not task:
+            raise PavementError("Requirement %s for task %s not found" %
+                (req, task_name))
+        if not isinstance(task, Task):
+            raise PavementError("Requirement %s for task %s is not a Task"
+                % (req, task_name))
+        return task
+
+    def _run_needs_in_parallel(self, task_name, needs):
+        """Runs the requirements of task_name (and their requirements in
+        turn) on up to self.jobs worker threads. A task is started as
+        soon as everything it needs has finished, and tasks that have
+        already been called are not run again. When there is a build
+        history, the ready tasks that head the longest chains (by their
+        average durations) go first."""
+        # build the dependency graph of the tasks that still need to run.
+        # order is the order in which the tasks would run serially, and
+        # is used to pick among the tasks that are ready to go.
+        waiting_on = {}
+        order = []
+        def add_task(name, req):
+            task = self._get_needed_task(name, req)
+            if task.called or task in waiting_on:
+                return task
+            waiting_on[task] = None
+            deps = set()
+            for subreq in task.needs:
+                subtask = add_task(task.name, subreq)
+                if not subtask.called:
+                    deps.add(subtask)
+            waiting_on[task] = deps
+            order.append(task)
+            return task
+        for req in needs:
+            add_task(task_name, req)
+        
+        if not order:
+            return
+        if self.history is not None:
+            waited_on_by = {}
+            for task, deps in waiting_on.items():
+                waited_on_by.setdefault(task, [])
+                for dep in deps:
+                    waited_on_by.setdefault(dep, []).append(task)
+            lengths = _path_lengths(waited_on_by, 
+                                    self.history.average_durations())
+            # sort is stable, so tasks with no history keep their order
+            order.sort(key=lambda task: -lengths[task])
+        
+        condition = threading.Condition()
+        finished = set()
+        running = set()
+        failures = []
+        
+        def run(task):
+            if self._timings is not None:
+                self._timing_stack.parent = task_name
+            try:
+                try:
+                    if not task.called:
+                        task()
+                except:
+                    failures.append(sys.exc_info())
+            finally:
+                condition.acquire()
+                try:
+                    running.discard(task)
+                    finished.add(task)
+                    condition.notify()
+                finally:
+                    condition.release()
+        
+        condition.acquire()
+        try:
+            while order or running:
+                if not failures:
+                    for task in order[:]:
+                        if len(running) >= self.jobs:
+                            break
+                        if waiting_on[task] - finished:
+                            continue
+                        order.remove(task)
+                        running.add(task)
+                        worker = threading.Thread(target=run, args=(task,),
+                                                  name=task.name)
+                        worker.start()
+                    if order and not running:
+                        raise PavementError("Circular dependency among "
+                            "tasks needed by %s: %s" % (task_name,
+                            ", ".join([t.name for t in order])))
+                elif not running:
+                    break
+                condition.wait()
+        finally:
+            condition.release()
+        
+        if failures:
+            exc_type, exc_value, exc_tb = failures[0]
+            raise exc_type, exc_value, exc_tb
+
     def get_tasks(self):
+        """The tasks in the pavement, those defined in the modules that
+        have been imported (wherever they have been imported from), and
+        those offered by the task finders. The tasks of the modules come
+        from the registry kept by the task decorator, so no modules need
+        to be searched."""
         if self._all_tasks:
             return self._all_tasks
         result = set()
-        modules = set()
-        def scan_module(module):
-            modules.add(module)
-            for name in dir(module):
-                item = getattr(module, name, None)
-                if isinstance(item, Task):
-                    result.add(item)
-                if isinstance(item, types.ModuleType) and item not in modules:
-                    scan_module(item)
-        scan_module(self.pavement)
+        for name in dir(self.pavement):
+            item = getattr(self.pavement, name, None)
+            if isinstance(item, Task):
+                result.add(item)
+        for task in _registry.values():
+            if _is_registered(task):
+                result.add(task)
         for finder in self.task_finders:
             result.update(finder.get_tasks())
+        shortname_index = {}
+        for task in result:
+            shortname_index.setdefault(task.shortname, []).append(task)
+        self._shortname_index = shortname_index
         self._all_tasks = result
         return result
     
 environment_stack = []
 environment = Environment()
 
+class LogRecord(object):
+    """A message logged through the environment. The message is only
+    formatted with its arguments when getMessage is called, and a 
+    message that can't be formatted is shown along with the error 
+    rather than raising it."""
+    
+    level_names = {1: "debug", 2: "info", 3: "error"}
+    
+    def __init__(self, level, message, args, task=None):
+        self.level = level
+        self.levelname = self.level_names.get(level, str(level))
+        self.message = message
+        self.args = args
+        self.task = task
+        self.created = time.time()
+        self._output = None
+    
+    def getMessage(self):
+        if self._output is None:
+            # This conditional fixes an issue which arises if the message
+            # contains formatting directives but no args are provided.
+            if self.args:
+                try:
+                    self._output = self.message % self.args
+                except Exception, e:
+                    self._output = "%r %% %r (could not format: %s)" % (
+                        self.message, self.args, e)
+            else:
+                self._output = self.message
+        return self._output
+
+class JSONLinesSink(object):
+    """Writes every log record to a file as a line of JSON holding the
+    time, level, task and message. The records are written by a
+    background thread, so logging never waits for the file."""
+    
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, "a")
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._write_records)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        atexit.register(self.close)
+    
+    def emit(self, record):
+        self._queue.put(record)
+    
+    def _write_records(self):
+        try:
+            import json
+        except ImportError:
+            import simplejson as json
+        done = False
+        while not done:
+            records = [self._queue.get()]
+            # write whatever else has piled up in the meantime in one go
+            while True:
+                try:
+                    records.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+            lines = []
+            for record in records:
+                if record is None:
+                    done = True
+                    break
+                message = record.getMessage()
+                if isinstance(message, str):
+                    message = message.decode("utf-8", "replace")
+                elif not isinstance(message, unicode):
+                    message = unicode(message)
+                lines.append(json.dumps(dict(time=record.created, 
+                    level=record.levelname, task=record.task,
+                    message=message)) + "\n")
+            self._file.write("".join(lines))
+            self._file.flush()
+    
+    def close(self):
+        """Writes out the records that are still queued and closes the 
+        file."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+
+class _TaskOutput(object):
+    """The records logged while a top-level task runs, to show if it
+    fails. Once the records take up more than about spill_size bytes, 
+    all of the output goes to a gzipped temporary file, and only the 
+    last tail_lines records are kept in memory."""
+    
+    tail_lines = 1000
+    spill_size = 1024 * 1024
+    record_overhead = 200
+    
+    def __init__(self):
+        self._lines = collections.deque()
+        self._size = 0
+        # None until the output is spilled; False if that failed
+        self._spill = None
+        self._kept = False
+        self.filename = None
+        self._lock = threading.Lock()
+    
+    def append(self, record):
+        self._lock.acquire()
+        try:
+            self._lines.append(record)
+            if self._spill is None:
+                self._size += self._estimate_size(record)
+                if self._size <= self.spill_size:
+                    return
+                self._start_spilling()
+            elif self._spill:
+                self._write(record)
+            while len(self._lines) > self.tail_lines:
+                self._lines.popleft()
+        finally:
+            self._lock.release()
+    
+    def _estimate_size(self, record):
+        # the formatted message plus the record itself
+        output = record.getMessage()
+        if isinstance(output, basestring):
+            return self.record_overhead + len(output)
+        return self.record_overhead + 80
+    
+    def _start_spilling(self):
+        try:
+            fd, self.filename = tempfile.mkstemp(prefix="paver-output-", 
+                                                 suffix=".log.gz")
+            os.close(fd)
+            atexit.register(self.discard)
+            self._spill = gzip.GzipFile(self.filename, "wb")
+        except (IOError, OSError):
+            self._spill = False
+            return
+        for record in self._lines:
+            self._write(record)
+    
+    def _write(self, record):
+        output = record.getMessage()
+        if isinstance(output, unicode):
+            output = output.encode("utf-8")
+        try:
+            self._spill.write("%s\n" % output)
+        except (IOError, OSError):
+            # out of disk space, say: the tail will have to do
+            self._spill.close()
+            self._spill = False
+    
+    def lines(self):
+        self._lock.acquire()
+        try:
+            return [record.getMessage() for record in self._lines]
+        finally:
+            self._lock.release()
+    
+    def keep(self):
+        """Finishes writing the spilled output (if any) and keeps the 
+        file around for the user to look at."""
+        self._kept = True
+        if self._spill:
+            self._spill.close()
+            self._spill = False
+    
+    def discard(self):
+        if self._spill:
+            self._spill.close()
+            self._spill = False
+        if self.filename and not self._kept:
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def _max_rss():
+    """The peak resident set size (in KB) of this process or of any of
+    the subprocesses it has waited for, whichever is larger."""
+    if resource is None:
+        return None
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    if sys.platform == "darwin":
+        # reported in bytes rather than KB
+        rss = rss / 1024
+    return rss
+
+def _cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+def _cpu_time():
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+class _TaskTiming(object):
+    """How long a task took. total_time includes running the tasks it
+    needs; own_time and cpu_time only cover the task itself. cpu_time
+    and max_rss are for the whole process (and its subprocesses)."""
+    def __init__(self, name, parent, depth):
+        self.name = name
+        self.parent = parent
+        self.depth = depth
+        self.thread = threading.currentThread().getName()
+        self.start = self.own_start = time.time()
+        self.cpu_start = _cpu_time()
+        
+    def needs_done(self):
+        self.own_start = time.time()
+        self.cpu_start = _cpu_time()
+    
+    def finish(self):
+        self.end = time.time()
+        self.total_time = self.end - self.start
+        self.own_time = self.end - self.own_start
+        self.cpu_time = _cpu_time() - self.cpu_start
+        self.max_rss = _max_rss()
+
+def _write_chrome_trace(filename, timings):
+    """Writes the timings in the Trace Event Format that Chrome's
+    about:tracing (and Perfetto) can display."""
+    try:
+        import json
+    except ImportError:
+        import simplejson as json
+    if not timings:
+        return
+    origin = min([t.start for t in timings])
+    threads = {}
+    events = []
+    for timing in timings:
+        tid = threads.setdefault(timing.thread, len(threads) + 1)
+        args = dict(own_time=timing.own_time, cpu_time=timing.cpu_time)
+        if timing.parent:
+            args['needed_by'] = timing.parent
+        if timing.max_rss is not None:
+            args['max_rss_kb'] = timing.max_rss
+        events.append(dict(name=timing.name, cat="task", ph="X",
+                           ts=int((timing.start - origin) * 1000000),
+                           dur=int(timing.total_time * 1000000),
+                           pid=os.getpid(), tid=tid, args=args))
+    for name, tid in threads.items():
+        events.append(dict(name="thread_name", ph="M", pid=os.getpid(),
+                           tid=tid, args=dict(name=name)))
+    f = open(filename, "w")
+    try:
+        json.dump(dict(traceEvents=events), f, indent=1)
+    finally:
+        f.close()
+
+def _user_cache_dir():
+    """The directory in which Paver keeps its own caches, which outlive
+    a single project (compiled pavements, file hashes and the like):
+    ~/.cache/paver, or paver under $XDG_CACHE_HOME. Task outputs go to
+    the --cache-dir instead."""
+    base = os.environ.get("XDG_CACHE_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "paver")
+
+def _code_fingerprint(code):
+    """Hash of a code object that does not depend on line numbers, so
+    that edits elsewhere in the file do not change it."""
+    m = md5()
+    m.update(code.co_code)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            m.update(_code_fingerprint(const))
+        else:
+            m.update(repr(const))
+    m.update(repr(code.co_names))
+    m.update(repr(code.co_varnames))
+    return m.hexdigest()
+
+class _ResultCache(object):
+    """Stores the outputs of tasks in a directory that can be shared
+    between checkouts. Each entry is a tarball of a task's outputs,
+    keyed by the task's code, options and input file contents."""
+    
+    def __init__(self, dirname):
+        self.dirname = os.path.expanduser(dirname)
+    
+    def key_for(self, task, state):
+        m = md5()
+        m.update(task.name)
+        m.update(_code_fingerprint(task.func.func_code))
+        m.update(state['options'])
+        for filename in sorted(state['files']):
+            m.update("%s\0%s\0" % (filename, state['files'][filename][2]))
+        m.update(repr(list(task.outputs)))
+        return m.hexdigest()
+    
+    def _entry(self, key):
+        return os.path.join(self.dirname, key[:2], key + ".tar.gz")
+    
+    def restore(self, key):
+        """Unpacks the outputs stored under key into the current
+        directory. Returns False if there is no such entry, or it can't
+        be used: it is empty or unreadable, or (as the cache can be
+        shared) it holds anything but plain files and directories below
+        the current one."""
+        entry = self._entry(key)
+        if not os.path.exists(entry):
+            return False
+        try:
+            archive = tarfile.open(entry, "r:gz")
+            try:
+                members = archive.getmembers()
+                if not members:
+                    environment.debug("Ignoring empty cache entry %s", entry)
+                    return False
+                for member in members:
+                    if not (member.isfile() or member.isdir()) or \
+                        _is_outside(member.name):
+                        environment.debug("Ignoring cache entry %s: it "
+                            "holds %s", entry, member.name)
+                        return False
+                for member in members:
+                    archive.extract(member)
+            finally:
+                archive.close()
+        except (tarfile.TarError, IOError, OSError, EOFError, 
+                zlib.error), e:
+            environment.debug("Ignoring unreadable cache entry %s: %s", 
+                              entry, e)
+            return False
+        return True
+    
+    def store(self, key, outputs):
+        """Saves the files matching the outputs patterns under key. The
+        task has already succeeded, so failing to do so isn't an
+        error."""
+        files = _expand_files(outputs)
+        for filename in files:
+            if _is_outside(filename):
+                environment.debug("Not caching outputs: %s is outside of "
+                                  "the pavement directory", filename)
+                return
+        try:
+            entry = self._entry(key)
+            entry_dir = os.path.dirname(entry)
+            if not os.path.exists(entry_dir):
+                os.makedirs(entry_dir)
+            fd, tmpname = tempfile.mkstemp(dir=entry_dir, suffix=".tmp")
+            os.close(fd)
+            try:
+                archive = tarfile.open(tmpname, "w:gz")
+                try:
+                    for filename in files:
+                        archive.add(filename)
+                finally:
+                    archive.close()
+                os.rename(tmpname, entry)
+            except:
+                os.remove(tmpname)
+                raise
+        except (tarfile.TarError, IOError, OSError), e:
+            environment.debug("Could not cache the outputs: %s", e)
+
+def _is_outside(filename):
+    """Whether the relative path filename leads outside of the current
+    directory, or isn't relative at all."""
+    normalized = os.path.normpath(filename)
+    return (os.path.isabs(normalized) or normalized == os.pardir or
+            normalized.startswith(os.pardir + os.sep))
+
+def _expand_files(patterns):
+    """Returns the sorted list of files matching the glob patterns given.
+    Directories are expanded to all of the files below them."""
+    result = set()
+    for pattern in patterns:
+        for match in glob.glob(pattern):
+            if os.path.isdir(match):
+                for dirpath, dirnames, filenames in os.walk(match):
+                    for filename in filenames:
+                        result.add(os.path.join(dirpath, filename))
+            else:
+                result.add(match)
+    result = list(result)
+    result.sort()
+    return result
+
+def _file_digest(filename):
+    f = open(filename, "rb")
+    try:
+        m = md5()
+        while True:
+            d = f.read(65536)
+            if not d:
+                break
+            m.update(d)
+    finally:
+        f.close()
+    return m.hexdigest()
+
+def _options_fingerprint(task):
+    """Fingerprint of the options section belonging to the task,
+    which is where its command line options are stored."""
+    try:
+        section = dict.get(environment.options, task.shortname)
+    except (AttributeError, TypeError):
+        section = None
+    if isinstance(section, dict):
+        section = sorted(section.items())
+    return md5(repr(section)).hexdigest()
+
+class _BuildHistory(object):
+    """Keeps a record of every task run in a project. Each line of the
+    file holds the task name, start and end time, duration, status, 
+    options fingerprint and host, separated by tabs. Lines are only
+    ever appended."""
+    
+    fields = ("name", "start", "end", "duration", "status", "options", 
+              "host")
+    
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._averages = None
+    
+    def record(self, task_name, task, start, end, status):
+        if task is None:
+            options = "-"
+        else:
+            options = _options_fingerprint(task)
+        line = "%s\t%.6f\t%.6f\t%.6f\t%s\t%s\t%s\n" % (task_name, start, 
+            end, end - start, status, options, socket.gethostname())
+        self._lock.acquire()
+        try:
+            try:
+                f = open(self.filename, "a")
+                try:
+                    f.write(line)
+                finally:
+                    f.close()
+            except IOError, e:
+                environment.debug("Could not record build history: %s", e)
+        finally:
+            self._lock.release()
+    
+    def runs(self):
+        """All of the recorded runs, oldest first, as dictionaries."""
+        try:
+            f = open(self.filename)
+        except IOError:
+            return []
+        result = []
+        try:
+            for line in f:
+                values = line.rstrip("\n").split("\t")
+                if len(values) != len(self.fields):
+                    # a line cut short by an interrupted run
+                    continue
+                run = dict(zip(self.fields, values))
+                try:
+                    for field in ("start", "end", "duration"):
+                        run[field] = float(run[field])
+                except ValueError:
+                    continue
+                result.append(run)
+        finally:
+            f.close()
+        return result
+    
+    def average_durations(self, last=10):
+        """The average duration of each task over its last successful
+        runs (tasks skipped as up to date don't count)."""
+        if self._averages is None:
+            durations = {}
+            for run in self.runs():
+                if run["status"] == "ok":
+                    durations.setdefault(run["name"], []).append(
+                        run["duration"])
+            self._averages = dict([(name, sum(d[-last:]) / len(d[-last:]))
+                                   for name, d in durations.items()])
+        return self._averages
+
+def _path_lengths(graph, durations):
+    """For a graph mapping each task to the tasks that follow it, finds
+    the longest chain starting at each task, adding up the durations
+    (by task name) of the tasks along it. Returns a dictionary of the
+    lengths."""
+    lengths = {}
+    def length(task, visiting):
+        if task in lengths:
+            return lengths[task]
+        if task in visiting:
+            raise PavementError("Circular dependency among tasks: %s" %
+                                ", ".join([t.name for t in visiting]))
+        visiting.append(task)
+        longest = 0
+        for following in graph.get(task, ()):
+            longest = max(longest, length(following, visiting))
+        visiting.pop()
+        lengths[task] = durations.get(task.name, 0) + longest
+        return lengths[task]
+    for task in graph:
+        length(task, [])
+    return lengths
+
+class _StampDatabase(object):
+    """Remembers the input files (mtime, size and content hash) and the
+    options fingerprint of each task that declares inputs or outputs,
+    as of the last time that task ran successfully."""
+    
+    def __init__(self, filename):
+        self.filename = filename
+        self._stamps = None
+        # tasks run by -j finish (and record their state) on several
+        # threads
+        self._lock = threading.Lock()
+        
+    def _get_all(self):
+        self._lock.acquire()
+        try:
+            if self._stamps is None:
+                try:
+                    f = open(self.filename, "rb")
+                    try:
+                        self._stamps = pickle.load(f)
+                    finally:
+                        f.close()
+                except Exception:
+                    self._stamps = {}
+            return self._stamps
+        finally:
+            self._lock.release()
+    
+    def state_of(self, task):
+        """Returns the current state of the task's inputs and options.
+        Files whose mtime and size match the last recorded state are
+        not read again."""
+        previous = self._get_all().get(task.name, {}).get('files', {})
+        files = {}
+        for filename in _expand_files(task.inputs):
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            old = previous.get(filename)
+            if old and old[:2] == (st.st_mtime, st.st_size):
+                files[filename] = old
+            else:
+                files[filename] = (st.st_mtime, st.st_size, 
+                                   _file_digest(filename))
+        return dict(options=_options_fingerprint(task), files=files)
+    
+    def is_current(self, task, state):
+        """True if the task last ran successfully with the same options
+        and input file contents, and all of its outputs still exist."""
+        record = self._get_all().get(task.name)
+        if record is None or record['options'] != state['options']:
+            return False
+        for pattern in task.outputs:
+            if not glob.glob(pattern):
+                return False
+        old_files = record['files']
+        new_files = state['files']
+        if len(old_files) != len(new_files):
+            return False
+        for filename, stamp in new_files.items():
+            old = old_files.get(filename)
+            if old is None or old[1:] != stamp[1:]:
+                return False
+        return True
+    
+    def record(self, task, state):
+        """Stores the state that the task successfully ran with."""
+        stamps = self._get_all()
+        self._lock.acquire()
+        try:
+            if stamps.get(task.name) == state:
+                return
+            stamps[task.name] = state
+            self._save(dict(stamps))
+        finally:
+            self._lock.release()
+        
+    def save(self):
+        stamps = self._get_all()
+        self._lock.acquire()
+        try:
+            self._save(dict(stamps))
+        finally:
+            self._lock.release()
+    
+    def _save(self, stamps):
+        fd, tmpname = tempfile.mkstemp(
+            dir=os.path.dirname(self.filename) or os.curdir, 
+            prefix=os.path.basename(self.filename) + ".", suffix=".tmp")
+        try:
+            f = os.fdopen(fd, "wb")
+            try:
+                pickle.dump(stamps, f, 2)
+            finally:
+                f.close()
+            if os.name == "nt" and os.path.exists(self.filename):
+                # rename can't replace files on Windows
+                os.remove(self.filename)
+            os.rename(tmpname, self.filename)
+        except:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
+
 def _import_task(taskname):
     """Looks up a dotted task name and imports the module as necessary
     to get at the task."""
@@ -228,6 +1162,8 @@ class Task(object):
     called = False
     consume_args = False
     no_auto = False
+    inputs = ()
+    outputs = ()
     
     __doc__ = ""
     
@@ -239,13 +1175,16 @@ class Task(object):
         self.name = "%s.%s" % (func.__module__, func.__name__)
         self.option_names = set()
         self.user_options = []
+        self.inputs = []
+        self.outputs = []
         try:
             self.__doc__ = func.__doc__
         except AttributeError:
             pass
         
     def __call__(self, *args, **kw):
-        retval = environment._run_task(self.name, self.needs, self.func)
+        retval = environment._run_task(self.name, self.needs, self.func,
+                                       task=self)
         self.called = True
         return retval
     
@@ -344,6 +1283,18 @@ by another task in the dependency chain.""" % (self, option, task))
         return doc
 
 
+# every task made by the task decorator, by full name, so that
+# Environment.get_tasks and get_task don't have to search modules for them
+_registry = {}
+
+def _is_registered(task):
+    """Whether task (from the registry) is still what its module has
+    under its name. Tasks defined inside functions, and those replaced
+    by running a pavement again, don't count."""
+    module = sys.modules.get(task.func.__module__)
+    return module is not None and \
+        getattr(module, task.shortname, None) is task
+
 def task(func):
     """Specifies that this function is a task.
     
@@ -353,6 +1304,7 @@ def task(func):
     if isinstance(func, Task):
         return func
     task = Task(func)
+    _registry[task.name] = task
     return task
 
 def needs(*args):
@@ -366,21 +1318,49 @@ def needs(*args):
     The requirements are called in the order presented in the
     list."""
     def entangle(func):
-        req = args
         func = task(func)
-        needs_list = func.needs
-        if len(req) == 1:
-            req = req[0]
-        if isinstance(req, basestring):
-            needs_list.append(req)
-        elif isinstance(req, (list, tuple)):
-            needs_list.extend(req)
-        else:
-            raise PavementError("'needs' decorator requires a list or string "
-                                "but got %s" % req)
+        _extend_from_args(func.needs, args, 'needs')
+        return func
+    return entangle
+
+def inputs(*args):
+    """Specifies the files that this task reads. Like needs, this takes
+    a string, a list of strings or several string arguments, and it can
+    be used more than once. Each entry is a glob pattern; a directory
+    stands for all of the files below it.
+    
+    A task that declares inputs or outputs is skipped when none of
+    its input files and none of the options in its own options section
+    have changed since it last ran successfully, and all of its outputs 
+    still exist. The state of the inputs is kept in a .paver_stamps
+    file next to the pavement."""
+    def entangle(func):
+        func = task(func)
+        _extend_from_args(func.inputs, args, 'inputs')
         return func
     return entangle
 
+def outputs(*args):
+    """Specifies the files that this task creates, as glob patterns.
+    The task is not considered up to date if any of the patterns
+    does not match anything. See inputs."""
+    def entangle(func):
+        func = task(func)
+        _extend_from_args(func.outputs, args, 'outputs')
+        return func
+    return entangle
+
+def _extend_from_args(target, args, decorator_name):
+    if len(args) == 1:
+        args = args[0]
+    if isinstance(args, basestring):
+        target.append(args)
+    elif isinstance(args, (list, tuple)):
+        target.extend(args)
+    else:
+        raise PavementError("'%s' decorator requires a list or string "
+                            "but got %s" % (decorator_name, args))
+
 def cmdopts(options):
     """Sets the command line options that can be set for this task.
     This uses the same format as the distutils command line option
@@ -456,9 +1436,39 @@ def _parse_global_options(args):
                     help="enable prompting")
     parser.add_option("-f", "--file", metavar="FILE",
                     help="read tasks from FILE [%default]")
+    parser.add_option("-j", "--jobs", type="int", metavar="N",
+                    help="run up to N independent tasks at once [%default]")
+    parser.add_option("--cache-dir", metavar="DIR",
+                    help="restore the outputs of tasks from, and save "
+                    "them to, the cache in DIR [%default]")
+    parser.add_option("-w", "--watch", action="store_true",
+                    help="run the tasks again whenever their inputs change")
+    parser.add_option("--timings", action="store_true",
+                    help="show how long each task took at the end")
+    parser.add_option("--trace-file", metavar="FILE",
+                    help="write the task timings to FILE in Chrome's "
+                    "trace format (implies --timings)")
+    parser.add_option("--profile", metavar="TASK",
+                    help="run TASK under the profiler and save the "
+                    "statistics in TASK.pstats")
+    parser.add_option("--log-json", metavar="FILE",
+                    help="also write every log message to FILE as JSON")
+    parser.add_option("--daemon", action="store_true",
+                    help="keep the pavement loaded in a server that later "
+                    "paver commands for this project are run in")
+    parser.add_option("--no-daemon", action="store_true",
+                    help="don't hand this command to a running daemon")
     parser.add_option('-h', "--help", action="store_true",
                     help="display this help information")
-    parser.set_defaults(file=environment.pavement_file)
+    parser.set_defaults(file=environment.pavement_file,
+                        jobs=environment.jobs,
+                        cache_dir=environment.cache_dir or 
+                                  os.environ.get("PAVER_CACHE_DIR"),
+                        watch=environment.watch,
+                        timings=environment.timings,
+                        trace_file=environment.trace_file,
+                        profile=environment.profile,
+                        log_json=environment.log_json)
 
     parser.disable_interspersed_args()
     options, args = parser.parse_args(args)
@@ -554,21 +1564,40 @@ def help(args, help_function):
 
 def _process_commands(args, auto_pending=False):
     first_loop = True
-    while True:
-        task, args = _parse_command_line(args)
-        if auto_pending:
-            if not task or not task.no_auto:
-                environment.call_task('auto')
-                auto_pending=False
-        if task is None:
-            if first_loop:
-                task = environment.get_task('default')
-                if not task:
+    called = []
+    # what the watched inputs looked like before the tasks ran
+    snapshot = {}
+    try:
+        while True:
+            task, args = _parse_command_line(args)
+            if auto_pending:
+                if not task or not task.no_auto:
+                    environment.call_task('auto')
+                    auto_pending=False
+            if task is None:
+                if first_loop:
+                    task = environment.get_task('default')
+                    if not task:
+                        break
+                else:
                     break
-            else:
-                break
-        task()
-        first_loop = False
+            called.append(task)
+            if environment.watch:
+                from paver import watch
+                for filename, stamp in \
+                        watch.inputs_snapshot([task]).items():
+                    snapshot.setdefault(filename, stamp)
+            task()
+            first_loop = False
+    except SystemExit:
+        # a failed task shouldn't stop us from watching for the fix
+        if not environment.watch or not called:
+            environment._report_timings()
+            raise
+    environment._report_timings()
+    if environment.watch and called:
+        from paver import watch
+        watch.watch(called, snapshot)
 
 def call_pavement(new_pavement, args):
     if isinstance(args, basestring):
@@ -587,11 +1616,13 @@ def call_pavement(new_pavement, args):
         os.chdir(cwd)
     environment = environment_stack.pop()
 
-def _launch_pavement(args):
-    mod = types.ModuleType("pavement")
-    environment.pavement = mod
-    
-
+def _find_pavement():
+    """Looks for the pavement file in the current directory and then in
+    the directories above it, and changes to the directory that contains
+    it. environment.pavement_file is set to the full path of the 
+    pavement, or to None if there isn't one."""
+    if not environment.pavement_file:
+        return
     _cwd = os.getcwd()
     while _cwd != os.path.dirname(_cwd):
         _file = os.path.join(_cwd, environment.pavement_file)
@@ -604,20 +1635,97 @@ def _launch_pavement(args):
 
     if not os.path.exists(environment.pavement_file):
         environment.pavement_file = None
+
+def _compile_pavement(filename):
+    """Compiles the pavement. The code object is cached under pavements/
+    in the user's cache directory and used again for as long as the 
+    file's size and modification time (and the Python version) are the
+    same."""
+    st = os.stat(filename)
+    fingerprint = (filename, st.st_mtime, st.st_size)
+    cache_file = os.path.join(_user_cache_dir(), "pavements",
+        md5(os.path.abspath(filename)).hexdigest())
+    try:
+        f = open(cache_file, "rb")
+        try:
+            if f.read(4) == imp.get_magic() and \
+                    marshal.load(f) == fingerprint:
+                code = marshal.load(f)
+                if isinstance(code, types.CodeType):
+                    return code
+        finally:
+            f.close()
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        pass
+    
+    source = open(filename, "rU").read()
+    if not source.endswith("\n"):
+        source += "\n"
+    code = compile(source, filename, "exec", 0, True)
+    try:
+        cache_dir = os.path.dirname(cache_file)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        fd, tmpname = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        f = os.fdopen(fd, "wb")
+        try:
+            f.write(imp.get_magic())
+            marshal.dump(fingerprint, f)
+            marshal.dump(code, f)
+        finally:
+            f.close()
+        os.rename(tmpname, cache_file)
+    except (IOError, OSError), e:
+        environment.debug("Could not cache the compiled pavement: %s", e)
+    return code
+
+def _load_pavement():
+    """Runs the pavement file (see _find_pavement) in a new pavement 
+    module. Returns True if the pavement has an auto task to be run."""
+    mod = types.ModuleType("pavement")
+    environment.pavement = mod
+    
+    if environment.pavement_file is None:
         exec "from paver.easy import *\n" in mod.__dict__
+        return False
+    
+    mod.__file__ = environment.pavement_file
+    environment.history = _BuildHistory(os.path.join(
+        os.path.dirname(os.path.abspath(environment.pavement_file)),
+        ".paver_history"))
+    exec _compile_pavement(environment.pavement_file) in mod.__dict__
+    auto_task = getattr(mod, 'auto', None)
+    return isinstance(auto_task, Task)
+
+def _report_pavement_error(e):
+    print "\n\n*** Problem with pavement:\n%s\n%s\n\n" % (
+                os.path.abspath(environment.pavement_file), e)
+
+def _launch_pavement(args):
+    _find_pavement()
+    if environment.pavement_file is None:
+        _load_pavement()
         _process_commands(args)
         return
 
-        
-    mod.__file__ = environment.pavement_file
     try:
-        execfile(environment.pavement_file, mod.__dict__)
-        auto_task = getattr(mod, 'auto', None)
-        auto_pending = isinstance(auto_task, Task)
+        auto_pending = _load_pavement()
         _process_commands(args, auto_pending=auto_pending)
     except PavementError, e:
-        print "\n\n*** Problem with pavement:\n%s\n%s\n\n" % (
-                    os.path.abspath(environment.pavement_file), e)
+        _report_pavement_error(e)
+
+def _run_in_daemon(command_line):
+    """Hands the command line to the paver daemon serving this project,
+    if there is one. Returns the exit code, or None if the command line
+    still needs to be run here."""
+    _find_pavement()
+    if environment.pavement_file is None:
+        return None
+    try:
+        from paver import daemon
+    except ImportError:
+        return None
+    return daemon.run_client(environment.pavement_file, command_line)
 
 def main(args=None):
     global environment
@@ -630,7 +1738,16 @@ def main(args=None):
 
     # need to parse args to recover pavement-file to read before executing
     try:
+        command_line = list(args)
         args = _parse_global_options(args)
+        if environment.daemon:
+            from paver import daemon
+            daemon.serve()
+            return
+        if not environment.no_daemon:
+            code = _run_in_daemon(command_line)
+            if code is not None:
+                sys.exit(code)
         _launch_pavement(args)
     except BuildFailure, e:
         environment.error("Build failed: %s", e)
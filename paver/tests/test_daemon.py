@@ -0,0 +1,138 @@
+import os
+import sys
+import shutil
+import signal
+import tempfile
+import time
+from StringIO import StringIO
+
+from paver import daemon, tasks
+
+_pavement = """from paver.easy import *
+
+@task
+def hello():
+    print "hello from the daemon"
+
+@task
+def exits():
+    import atexit, os
+    filename = os.path.join(os.getcwd(), "exited")
+    atexit.register(lambda: open(filename, "w").close())
+
+@task
+def broken():
+    raise BuildFailure("broken")
+"""
+
+_saved = {}
+
+def setup():
+    """Keeps the sockets and caches made by these tests in directories
+    of their own."""
+    _saved['tempdir'] = tempfile.tempdir
+    _saved['environment'] = tasks.environment
+    _saved['XDG_CACHE_HOME'] = os.environ.get('XDG_CACHE_HOME')
+    tempfile.tempdir = tempfile.mkdtemp()
+    os.environ['XDG_CACHE_HOME'] = os.path.join(tempfile.tempdir, 'cache')
+
+def teardown():
+    shutil.rmtree(tempfile.tempdir)
+    tempfile.tempdir = _saved['tempdir']
+    tasks.environment = _saved['environment']
+    if _saved['XDG_CACHE_HOME'] is None:
+        del os.environ['XDG_CACHE_HOME']
+    else:
+        os.environ['XDG_CACHE_HOME'] = _saved['XDG_CACHE_HOME']
+
+def _make_project():
+    project = tempfile.mkdtemp()
+    f = open(os.path.join(project, 'pavement.py'), 'w')
+    f.write(_pavement)
+    f.close()
+    return project
+
+def _run_client(pavement_file, args):
+    """Runs daemon.run_client, returning its result and what it wrote
+    to stdout and stderr."""
+    old_stdout, old_stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = StringIO(), StringIO()
+    try:
+        code = daemon.run_client(pavement_file, args)
+        return code, sys.stdout.getvalue(), sys.stderr.getvalue()
+    finally:
+        sys.stdout, sys.stderr = old_stdout, old_stderr
+
+def _start_daemon(project):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            devnull = os.open(os.devnull, os.O_RDWR)
+            os.dup2(devnull, 1)
+            os.dup2(devnull, 2)
+            sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+            os.chdir(project)
+            tasks.environment = tasks.Environment()
+            daemon.serve()
+        finally:
+            os._exit(0)
+    path = daemon.socket_path(os.path.join(project, 'pavement.py'))
+    for i in range(100):
+        if daemon._is_own_socket(path):
+            break
+        time.sleep(0.1)
+    return pid
+
+def test_commands_run_in_the_daemon():
+    if not daemon._available():
+        return
+    project = _make_project()
+    pid = _start_daemon(project)
+    try:
+        pavement_file = os.path.join(project, 'pavement.py')
+        code, out, err = _run_client(pavement_file, ['hello'])
+        assert code == 0, err
+        assert "hello from the daemon" in out
+        code, out, err = _run_client(pavement_file, ['exits'])
+        assert code == 0, err
+        assert os.path.exists(os.path.join(project, 'exited'))
+        code, out, err = _run_client(pavement_file, ['broken'])
+        assert code == 1
+        assert "Build failed running pavement.broken: broken" in out
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+        shutil.rmtree(project)
+    # the daemon removes its socket when it stops
+    assert _run_client(pavement_file, ['hello'])[0] is None
+
+def test_client_only_uses_private_sockets():
+    if not daemon._available():
+        return
+    project = _make_project()
+    try:
+        pavement_file = os.path.join(project, 'pavement.py')
+        assert _run_client(pavement_file, ['hello'])[0] is None
+
+        # something that isn't a socket
+        path = daemon.socket_path(pavement_file)
+        open(path, 'w').close()
+        assert _run_client(pavement_file, ['hello'])[0] is None
+        os.remove(path)
+
+        # a socket directory that others can get into
+        os.chmod(os.path.dirname(path), 0755)
+        try:
+            daemon.socket_path(pavement_file)
+            assert False, "Expected OSError"
+        except OSError:
+            pass
+        code, out, err = _run_client(pavement_file, ['hello'])
+        assert code is None
+        assert "not a private directory" in err
+    finally:
+        socket_dir = os.path.join(tempfile.gettempdir(),
+                                  'paver-%s' % os.getuid())
+        if os.path.isdir(socket_dir):
+            os.chmod(socket_dir, 0700)
+        shutil.rmtree(project)
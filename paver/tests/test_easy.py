@@ -1,6 +1,12 @@
+import os
+import sys
+import shutil
+import tempfile
+
 from paver import easy
 from paver.tests.mock import patch, Mock
 import subprocess # for easy.sh tests
+from StringIO import StringIO
 
 
 @patch(subprocess, "Popen")
@@ -8,7 +14,8 @@ import subprocess # for easy.sh tests
 def test_sh_raises_BuildFailure(popen, error):
     popen.return_value = Mock()
     popen.return_value.returncode = 1
-    popen.return_value.stderr.read.return_value = 'some stderr'
+    popen.return_value.stderr = StringIO('some stderr')
+    popen.return_value.stdout = StringIO('')
 
     try:
         easy.sh('foo')
@@ -30,7 +37,8 @@ def test_sh_raises_BuildFailure(popen, error):
 def test_sh_with_capture_raises_BuildFailure(popen):
     popen.return_value = Mock()
     popen.return_value.returncode = 1
-    popen.return_value.stderr.read.return_value = 'some stderr'
+    popen.return_value.stderr = StringIO('some stderr')
+    popen.return_value.stdout = StringIO('')
     try:
         easy.sh('foo', capture=True)
     except easy.BuildFailure, e:
@@ -49,7 +57,8 @@ def test_sh_with_capture_raises_BuildFailure(popen):
 def test_sh_ignores_error(popen):
     popen.return_value = Mock()
     popen.return_value.returncode = 1
-    popen.return_value.stderr.read.return_value = 'some stderr'
+    popen.return_value.stderr = StringIO('some stderr')
+    popen.return_value.stdout = StringIO('')
     easy.sh('foo', ignore_error=True)
 
     assert popen.called
@@ -63,7 +72,8 @@ def test_sh_ignores_error(popen):
 def test_sh_ignores_error_with_capture(popen):
     popen.return_value = Mock()
     popen.return_value.returncode = 1
-    popen.return_value.stderr.read.return_value = 'some stderr'
+    popen.return_value.stderr = StringIO('some stderr')
+    popen.return_value.stdout = StringIO('')
     easy.sh('foo', capture=True, ignore_error=True)
 
     assert popen.called
@@ -71,3 +81,64 @@ def test_sh_ignores_error_with_capture(popen):
     assert popen.call_args[1]['shell'] == True
     assert popen.call_args[1]['stdout'] == subprocess.PIPE
     assert popen.call_args[1]['stderr'] == subprocess.PIPE
+
+def test_sh_keeps_the_end_of_long_output():
+    output = easy.sh('%s -c "print(\'x\' * 100000); print(\'done\')"'
+                     % sys.executable, capture=True, capture_limit=10)
+    assert output == "xxxx\ndone\n", repr(output)
+
+def test_sh_rejects_a_capture_limit_that_keeps_nothing():
+    for limit in (0, -1):
+        try:
+            easy.sh('echo hello', capture=True, capture_limit=limit)
+            assert False, "Expected ValueError"
+        except ValueError:
+            pass
+
+def test_sh_writes_output_to_a_file():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, "output.txt")
+        output = easy.sh('%s -c "import sys; print(\'out\'); '
+                         'sys.stdout.flush(); sys.stderr.write(\'err\\\\n\')"'
+                         % sys.executable, capture=True, output_file=filename)
+        assert output == "out\n"
+        assert sorted(open(filename).read().split()) == ["err", "out"]
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_sh_many_returns_output_in_order():
+    commands = ['%s -c "import time; time.sleep(%s); print(%d)"'
+                % (sys.executable, 0.2 - i * 0.1, i) for i in range(3)]
+    assert easy.sh_many(commands, jobs=3) == ["0\n", "1\n", "2\n"]
+
+def test_sh_many_reports_all_failures():
+    commands = ["exit 3", "echo fine", "exit 4"]
+    try:
+        easy.sh_many(commands, jobs=2)
+    except easy.BuildFailure, e:
+        message = str(e)
+    else:
+        assert False, "expected BuildFailure"
+    assert message.startswith("2 of 3 commands failed"), message
+    assert "[1] exit 3 (return code 3)" in message
+    assert "[3] exit 4 (return code 4)" in message
+
+def test_sh_many_reports_commands_that_could_not_be_started():
+    try:
+        easy.sh_many(["echo fine", None], jobs=2)
+    except easy.BuildFailure, e:
+        message = str(e)
+    else:
+        assert False, "expected BuildFailure"
+    assert message.startswith("1 of 2 commands failed"), message
+    assert "[2] None (return code -1)" in message
+
+@patch(subprocess, "Popen")
+def test_sh_many_respects_dry_run(popen):
+    easy.environment.dry_run = True
+    try:
+        assert easy.sh_many(["foo", "bar"]) == [None, None]
+    finally:
+        easy.environment.dry_run = False
+    assert not popen.called
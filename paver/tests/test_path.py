@@ -0,0 +1,488 @@
+import os
+import shutil
+import tempfile
+import time
+import warnings
+
+from paver import path as path_module
+from paver.path import path, TreeWalkWarning
+
+_saved = {}
+
+def setup():
+    """Keeps the hashes of the files made by these tests out of the
+    developer's own cache."""
+    _saved['XDG_CACHE_HOME'] = os.environ.get('XDG_CACHE_HOME')
+    _saved['hash_cache'] = path_module._hash_cache
+    _saved['cache_home'] = tempfile.mkdtemp()
+    os.environ['XDG_CACHE_HOME'] = _saved['cache_home']
+    path_module._hash_cache = path_module._HashCache()
+
+def teardown():
+    # nothing is saved when Paver exits
+    path_module._hash_cache._dirty = False
+    path_module._hash_cache = _saved['hash_cache']
+    if _saved['XDG_CACHE_HOME'] is None:
+        del os.environ['XDG_CACHE_HOME']
+    else:
+        os.environ['XDG_CACHE_HOME'] = _saved['XDG_CACHE_HOME']
+    shutil.rmtree(_saved['cache_home'])
+
+def _make_tree():
+    """A temporary directory holding a few files, directories and a
+    broken symbolic link. The caller removes it."""
+    root = path(tempfile.mkdtemp())
+    (root / 'a' / 'b').makedirs()
+    (root / 'c').mkdir()
+    for name in ['top.txt', 'a/one.txt', 'a/one.py', 'a/b/two.txt']:
+        (root / name).write_text(name)
+    if hasattr(os, 'symlink'):
+        os.symlink(root / 'missing', root / 'broken')
+    return root
+
+def _names(root, items):
+    return sorted([root.relpathto(item) for item in items])
+
+def test_walkers():
+    root = _make_tree()
+    try:
+        assert _names(root, root.walkfiles()) == [
+            'a/b/two.txt', 'a/one.py', 'a/one.txt', 'top.txt']
+        assert _names(root, root.walkfiles('*.txt')) == [
+            'a/b/two.txt', 'a/one.txt', 'top.txt']
+        assert _names(root, root.walkdirs()) == ['a', 'a/b', 'c']
+        expected = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            expected.extend([os.path.join(dirpath, name)
+                             for name in dirnames + filenames])
+        assert _names(root, root.walk()) == _names(root, expected)
+    finally:
+        shutil.rmtree(root)
+
+def test_walk_yields_directories_before_their_contents():
+    root = _make_tree()
+    try:
+        items = list(root.walk())
+        assert items.index(root / 'a') < items.index(root / 'a' / 'b')
+        assert items.index(root / 'a' / 'b') < \
+            items.index(root / 'a' / 'b' / 'two.txt')
+    finally:
+        shutil.rmtree(root)
+
+def test_walkers_without_scandir():
+    root = _make_tree()
+    old_scandir = path_module._scandir
+    path_module._scandir = None
+    try:
+        assert _names(root, root.walkfiles('*.txt')) == [
+            'a/b/two.txt', 'a/one.txt', 'top.txt']
+        assert _names(root, root.walkdirs()) == ['a', 'a/b', 'c']
+    finally:
+        path_module._scandir = old_scandir
+        shutil.rmtree(root)
+
+def test_walk_errors():
+    missing = path(tempfile.mkdtemp()) / 'missing'
+    try:
+        try:
+            list(missing.walkfiles())
+            assert False, "Expected OSError"
+        except OSError:
+            pass
+        assert list(missing.walk(errors='ignore')) == []
+        caught = warnings.catch_warnings(record=True)
+        recorded = caught.__enter__()
+        try:
+            warnings.simplefilter('always')
+            assert list(missing.walkdirs(errors='warn')) == []
+        finally:
+            caught.__exit__(None, None, None)
+        assert len(recorded) == 1
+        assert recorded[0].category is TreeWalkWarning
+        try:
+            list(missing.walk(errors='bogus'))
+            assert False, "Expected ValueError"
+        except ValueError:
+            pass
+    finally:
+        missing.parent.rmdir()
+
+def test_exclude_and_prune():
+    root = _make_tree()
+    try:
+        assert _names(root, root.walkfiles(exclude=['*.py', '/top.txt'])) \
+            == ['a/b/two.txt', 'a/one.txt']
+        assert _names(root, root.walk(exclude='b/')) == [
+            'a', 'a/one.py', 'a/one.txt', 'broken', 'c', 'top.txt']
+        assert _names(root, root.walk(prune=['a/b'])) == [
+            'a', 'a/b', 'a/one.py', 'a/one.txt', 'broken', 'c', 'top.txt']
+        assert _names(root, root.walkfiles(exclude='**/*.txt')) == [
+            'a/one.py']
+    finally:
+        shutil.rmtree(root)
+
+def test_ignore_patterns():
+    root = _make_tree()
+    try:
+        (root / '.gitignore').write_text(
+            "# build output\n\n*.py\n!keep.py\nb/  \n")
+        assert path_module.ignore_patterns(root / '.gitignore') == [
+            '*.py', 'b/']
+        assert _names(root, root.walkfiles(
+            exclude=path_module.ignore_patterns(root / '.gitignore'))) == [
+            '.gitignore', 'a/one.txt', 'top.txt']
+    finally:
+        shutil.rmtree(root)
+
+def test_recursive_glob():
+    root = _make_tree()
+    try:
+        (root / '.hidden').mkdir()
+        (root / '.hidden' / 'secret.txt').write_text('')
+        assert _names(root, root.glob('**/*.txt')) == [
+            'a/b/two.txt', 'a/one.txt', 'top.txt']
+        assert _names(root, root.glob('a/**')) == [
+            'a/b', 'a/b/two.txt', 'a/one.py', 'a/one.txt']
+        assert _names(root, root.glob('a/**/two.txt')) == ['a/b/two.txt']
+        assert _names(root, root.glob('*.txt')) == ['top.txt']
+    finally:
+        shutil.rmtree(root)
+
+def test_glob_several_patterns_in_one_walk():
+    root = _make_tree()
+    listed = []
+    original_scan = path._scan
+    def scan(self, errors):
+        listed.append(root.relpathto(self))
+        return original_scan(self, errors)
+    path._scan = scan
+    try:
+        assert _names(root, root.glob(['a/**/*.py', 'a/b/*.txt', 
+                                       root / '*.txt'])) == [
+            'a/b/two.txt', 'a/one.py', 'top.txt']
+        # the absolute pattern lists root; 'c' is never looked in
+        assert sorted(listed) == ['.', 'a', 'a/b']
+    finally:
+        path._scan = original_scan
+        shutil.rmtree(root)
+
+def test_read_hash_is_cached():
+    import hashlib
+    root = path(tempfile.mkdtemp())
+    old_hash_file = path_module._hash_file
+    old_hash_cache = path_module._hash_cache
+    path_module._hash_cache = path_module._HashCache()
+    hashed = []
+    def hash_file(filename, algo):
+        hashed.append((filename, algo))
+        return old_hash_file(filename, algo)
+    path_module._hash_file = hash_file
+    try:
+        f = root / 'file.txt'
+        f.write_text('some text')
+        expected = hashlib.sha256('some text').hexdigest()
+        # too new to be cached
+        assert f.read_hash('sha256') == expected
+        assert f.read_hash('sha256') == expected
+        assert len(hashed) == 2
+        
+        os.utime(f, (1000000000, 1000000000))
+        assert f.read_hash('sha256') == expected
+        assert f.read_md5() == hashlib.md5('some text').digest()
+        assert len(hashed) == 4
+        path_module._hash_cache.save()
+        
+        # a later run
+        path_module._hash_cache = path_module._HashCache()
+        assert f.read_hash('sha256') == expected
+        assert f.read_md5() == hashlib.md5('some text').digest()
+        assert len(hashed) == 4
+        
+        f.write_text('other text')
+        os.utime(f, (1000000000, 1000000000))
+        assert f.read_hash('sha256') == hashlib.sha256('other text').hexdigest()
+        assert len(hashed) == 5
+    finally:
+        path_module._hash_file = old_hash_file
+        path_module._hash_cache._dirty = False
+        path_module._hash_cache = old_hash_cache
+        shutil.rmtree(root)
+
+def test_hash_tree():
+    root = _make_tree()
+    try:
+        before = root.hash_tree(jobs=2)
+        assert sorted(before.files) == [
+            'a/b/two.txt', 'a/one.py', 'a/one.txt', 'top.txt']
+        # c has no files, so it is left out
+        assert sorted(before.subtrees) == ['', 'a', 'a/b']
+        assert before.files['top.txt'] == (root / 'top.txt').read_hash()
+        assert root.hash_tree().digest == before.digest
+        assert root.hash_tree('*.txt').digest != before.digest
+        
+        (root / 'a' / 'b' / 'two.txt').write_text('changed')
+        (root / 'c' / 'new.txt').write_text('new')
+        after = root.hash_tree()
+        assert after.digest != before.digest
+        assert after.subtrees['a'] != before.subtrees['a']
+        assert after.files['a/one.txt'] == before.files['a/one.txt']
+        assert after.changed(before) == ['a', 'a/b', 'a/b/two.txt', 'c', 
+                                         'c/new.txt']
+        assert before.changed(after) == after.changed(before)
+    finally:
+        shutil.rmtree(root)
+
+def test_write_if_changed():
+    root = path(tempfile.mkdtemp())
+    try:
+        f = root / 'file.txt'
+        assert f.write_text('first', if_changed=True)
+        assert f.text() == 'first'
+        f.chmod(0640)
+        os.utime(f, (1000000000, 1000000000))
+        assert not f.write_text('first', if_changed=True)
+        assert not f.write_lines(['fir', 'st'], linesep='', if_changed=True)
+        assert f.mtime == 1000000000
+        assert f.write_bytes('second', if_changed=True)
+        assert f.bytes() == 'second'
+        assert f.mtime != 1000000000
+        assert f.stat().st_mode & 0777 == 0640
+        # no temporary files are left behind
+        assert root.listdir() == [f]
+        try:
+            f.write_text('third', append=True, if_changed=True)
+            assert False, "Expected ValueError"
+        except ValueError:
+            pass
+    finally:
+        shutil.rmtree(root)
+
+def test_sync_to():
+    from paver import tasks
+    root = _make_tree()
+    dst = path(tempfile.mkdtemp()) / 'copy'
+    try:
+        copied, deleted = root.sync_to(dst, exclude='*.py')
+        assert copied == ['a/b/two.txt', 'a/one.txt', 'top.txt']
+        assert deleted == []
+        assert _names(dst, dst.walk()) == [
+            'a', 'a/b', 'a/b/two.txt', 'a/one.txt', 'c', 'top.txt']
+        assert (dst / 'a' / 'one.txt').text() == 'a/one.txt'
+        assert root.sync_to(dst, exclude='*.py') == ([], [])
+
+        (root / 'top.txt').write_text('changed top')
+        (dst / 'stale.txt').write_text('')
+        (dst / 'c' / 'd').makedirs()
+        (dst / 'kept.py').write_text('')
+        # the same size and modification time, but not the same contents
+        (dst / 'a' / 'one.txt').write_text('a/ONE.txt')
+        shutil.copystat(root / 'a' / 'one.txt', dst / 'a' / 'one.txt')
+        assert root.sync_to(dst, exclude='*.py') == (['top.txt'], [])
+
+        tasks.environment.dry_run = True
+        try:
+            assert root.sync_to(dst, delete=True, exclude='*.py',
+                                checksum=True) == (
+                ['a/one.txt'], ['c/d', 'stale.txt'])
+            assert (dst / 'stale.txt').exists()
+        finally:
+            tasks.environment.dry_run = False
+        root.sync_to(dst, delete=True, exclude='*.py', checksum=True, jobs=2)
+        assert _names(dst, dst.walk()) == [
+            'a', 'a/b', 'a/b/two.txt', 'a/one.txt', 'c', 'kept.py', 'top.txt']
+        assert (dst / 'a' / 'one.txt').text() == 'a/one.txt'
+        assert (dst / 'top.txt').text() == 'changed top'
+    finally:
+        shutil.rmtree(root)
+        shutil.rmtree(dst.parent)
+
+def test_copy_with_links():
+    root = _make_tree()
+    dst = path(tempfile.mkdtemp())
+    try:
+        top = root / 'top.txt'
+        assert top.copy(dst / 'copied.txt') == 'copy'
+        if hasattr(os, 'link'):
+            assert top.copy(dst, link='hard') == 'hard'
+            assert (dst / 'top.txt').stat().st_ino == top.stat().st_ino
+        # whether a clone can be made depends on the file system
+        assert top.copy(dst / 'cloned.txt', link='reflink') in [
+            'reflink', 'copy']
+        assert (dst / 'cloned.txt').text() == 'top.txt'
+        assert top.copy(dst / 'auto.txt', link='auto') in ['reflink', 'hard']
+        try:
+            top.copy(dst / 'bogus.txt', link='bogus')
+            assert False, "Expected ValueError"
+        except ValueError:
+            pass
+
+        root.copytree(dst / 'tree', symlinks=True, link='auto')
+        assert _names(dst / 'tree', (dst / 'tree').walkfiles()) == [
+            'a/b/two.txt', 'a/one.py', 'a/one.txt', 'top.txt']
+        root.sync_to(dst / 'synced', link='hard')
+        if hasattr(os, 'link'):
+            assert (dst / 'synced' / 'a' / 'one.py').stat().st_ino == \
+                (root / 'a' / 'one.py').stat().st_ino
+    finally:
+        shutil.rmtree(root)
+        shutil.rmtree(dst)
+
+def test_rmtree():
+    from paver import tasks
+    root = _make_tree()
+    outside = path(tempfile.mkdtemp())
+    old_batch = path_module._rmtree_batch
+    path_module._rmtree_batch = 2
+    try:
+        (outside / 'keep.txt').write_text('')
+        if hasattr(os, 'symlink'):
+            os.symlink(outside, root / 'a' / 'outside')
+        tasks.environment.dry_run = True
+        try:
+            root.rmtree()
+        finally:
+            tasks.environment.dry_run = False
+        assert (root / 'a' / 'b' / 'two.txt').exists()
+        root.rmtree(jobs=3)
+        assert not root.exists()
+        assert (outside / 'keep.txt').exists()
+        # nothing to do
+        root.rmtree()
+
+        root = _make_tree()
+        root.rmtree(background=True)
+        assert not root.exists()
+        for i in range(100):
+            leftovers = root.parent.glob('.paver-rmtree-*')
+            if not leftovers:
+                break
+            time.sleep(0.1)
+        assert not leftovers
+    finally:
+        path_module._rmtree_batch = old_batch
+        shutil.rmtree(outside)
+        if root.exists():
+            shutil.rmtree(root)
+
+def test_streaming_reads():
+    root = path(tempfile.mkdtemp())
+    try:
+        f = root / 'file.txt'
+        # a '\r\n' split between the blocks that iterlines reads
+        f.write_bytes('x' * 65535 + '\r\nsecond\rthird\n\xc3\xa9')
+        assert [len(line) for line in f.iterlines()] == [65536, 7, 6, 2]
+        assert f.lines(retain=False)[1:] == ['second', 'third', '\xc3\xa9']
+        expected = f.text('utf-8').splitlines(True)
+        assert list(f.iterlines('utf-8')) == expected
+        assert f.lines('utf-8') == expected
+        assert f.lines('utf-8', retain=False)[-3:] == [
+            u'second', u'third', u'\xe9']
+
+        assert [len(chunk) for chunk in f.iterchunks(30000)] == [
+            30000, 30000, 5552]
+        assert ''.join(f.iterchunks(1000)) == f.bytes()
+        assert u''.join(f.iterchunks(1000, 'utf-8')) == \
+            f.bytes().decode('utf-8')
+
+        mapped = f.map()
+        try:
+            assert mapped[:3] == 'xxx'
+            assert mapped.find('third') == 65544
+        finally:
+            mapped.close()
+        (root / 'empty').touch()
+        assert (root / 'empty').map() == ''
+    finally:
+        shutil.rmtree(root)
+
+def test_copying_over_a_link_keeps_the_source():
+    root = path(tempfile.mkdtemp())
+    try:
+        src = root / 'src.txt'
+        src.write_text('contents')
+        for link in ['auto', 'hard', 'reflink', None, 'auto']:
+            src.copy(root / 'dst.txt', link=link)
+            assert src.text() == 'contents'
+            assert (root / 'dst.txt').text() == 'contents'
+        if hasattr(os, 'link'):
+            os.remove(root / 'dst.txt')
+            os.link(src, root / 'dst.txt')
+        path_module._copy_file(src, root / 'dst.txt')
+        assert src.text() == 'contents'
+        assert (root / 'dst.txt').text() == 'contents'
+        assert sorted(root.listdir()) == [root / 'dst.txt', src]
+    finally:
+        shutil.rmtree(root)
+
+def test_write_if_changed_keeps_line_endings_and_links():
+    root = path(tempfile.mkdtemp())
+    try:
+        f = root / 'crlf.txt'
+        f.write_bytes('one\r\ntwo\r\n')
+        assert not f.write_bytes(f.bytes(), if_changed=True)
+        assert f.bytes() == 'one\r\ntwo\r\n'
+        if hasattr(os, 'symlink'):
+            os.symlink('crlf.txt', root / 'link.txt')
+            assert (root / 'link.txt').write_text('new', if_changed=True)
+            assert (root / 'link.txt').islink()
+            assert f.text() == 'new'
+    finally:
+        shutil.rmtree(root)
+
+def test_cog_replace_file_keeps_line_endings():
+    from paver.cog.cogapp import Cog
+    root = path(tempfile.mkdtemp())
+    try:
+        f = root / 'cogged.txt'
+        f.write_bytes('one\r\ntwo\r\n')
+        os.utime(f, (1000000000, 1000000000))
+        Cog().replaceFile(f, 'one\r\ntwo\r\n')
+        assert f.mtime == 1000000000
+        Cog().replaceFile(f, 'one\r\nthree\r\n')
+        assert f.bytes() == 'one\r\nthree\r\n'
+    finally:
+        shutil.rmtree(root)
+
+def test_hash_cache_drops_old_entries():
+    root = path(tempfile.mkdtemp())
+    old_limit = path_module._hash_cache_limit
+    try:
+        cache = path_module._HashCache()
+        cache._get_filename = lambda: root / 'file_hashes'
+        for i in range(4):
+            cache.set(i, (1, 1), 'md5', str(i))
+        old = time.time() - (path_module._hash_cache_days + 1) * 86400
+        cache._entries[0] = ((1, 1), {'md5': '0'}, old)
+        path_module._hash_cache_limit = 2
+        cache.save()
+        assert root.listdir() == [root / 'file_hashes']
+
+        later = path_module._HashCache()
+        later._get_filename = cache._get_filename
+        assert later.get(0, (1, 1), 'md5') is None
+        assert later.get(1, (1, 1), 'md5') is None
+        assert later.get(3, (1, 1), 'md5') == '3'
+        assert not later._dirty
+    finally:
+        path_module._hash_cache_limit = old_limit
+        cache._dirty = False
+        shutil.rmtree(root)
+
+def test_hash_cache_is_loaded_once_for_all_threads():
+    import threading
+    cache = path_module._HashCache()
+    def slow_filename():
+        time.sleep(0.1)
+        return os.path.join(_saved['cache_home'], 'no_such_file')
+    cache._get_filename = slow_filename
+    threads = [threading.Thread(target=cache.set, 
+                                args=(i, (1, 1), 'md5', str(i)))
+               for i in range(4)]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert sorted(cache._entries.keys()) == range(4)
+    finally:
+        cache._dirty = False
@@ -133,3 +133,74 @@ def test_needs_sdist_without_options():
     cmd = d.get_command_obj('sdist')
     assert not cmd.foo
     assert not _sdist.foo_set
+
+class _FakeDist(object):
+    project_name = "FakeProject"
+    version = "1.0"
+
+class _FakeEntryPoint(object):
+    name = "fake_cmd"
+    module_name = "fake.module"
+    attrs = ("fake_cmd",)
+    dist = _FakeDist()
+    loaded = 0
+    
+    def load(self, require=True):
+        _FakeEntryPoint.loaded += 1
+        class fake_cmd(Command):
+            description = "Does fake things"
+            user_options = []
+        return fake_cmd
+
+def test_distutils_task_finder_does_not_import_commands():
+    import os, tempfile, shutil
+    import pkg_resources
+    from paver import setuputils
+    
+    original = pkg_resources.iter_entry_points
+    pkg_resources.iter_entry_points = lambda group: [_FakeEntryPoint()]
+    cache_dir = tempfile.mkdtemp()
+    old_cache_home = os.environ.get('XDG_CACHE_HOME')
+    os.environ['XDG_CACHE_HOME'] = cache_dir
+    try:
+        env = _set_environment()
+        env.options = options.Bunch(setup=options.Bunch())
+        _FakeEntryPoint.loaded = 0
+        
+        all_tasks = DistutilsTaskFinder().get_tasks()
+        fake = [t for t in all_tasks if t.shortname == "fake_cmd"][0]
+        assert fake.name == "fake.module.fake_cmd"
+        assert _FakeEntryPoint.loaded == 0
+        install = [t for t in all_tasks if t.shortname == "install"][0]
+        assert install.name == "distutils.command.install"
+        
+        assert fake.description == "Does fake things"
+        assert _FakeEntryPoint.loaded == 1
+        setuputils._description_cache.save()
+        
+        # the description now comes from the cache
+        setuputils._description_cache = setuputils._DescriptionCache()
+        fake = DistutilsTask(_get_distribution(), "fake_cmd", 
+                             entry_point=_FakeEntryPoint())
+        assert fake.description == "Does fake things"
+        assert _FakeEntryPoint.loaded == 1
+    finally:
+        pkg_resources.iter_entry_points = original
+        if old_cache_home is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = old_cache_home
+        shutil.rmtree(cache_dir)
+
+class _BrokenEntryPoint(_FakeEntryPoint):
+    def load(self, require=True):
+        raise ImportError("No module named fake")
+
+def test_entry_points_that_fail_to_load_are_skipped():
+    env = _set_environment(patch_print=True)
+    env.options = options.Bunch(setup=options.Bunch())
+    broken = DistutilsTask(_get_distribution(), "fake_cmd", 
+                           entry_point=_BrokenEntryPoint())
+    assert broken.user_options == []
+    assert broken.parser.option_list
+    assert env.patch_captured[-1].startswith("Could not load entry point")
@@ -9,6 +9,24 @@ from paver.tests.utils import _set_environment, FakeExitException
 OP_T1_CALLED = 0
 subpavement = os.path.join(os.path.dirname(__file__), "other_pavement.py")
 
+_saved = {}
+
+def setup():
+    """Keeps the pavements compiled by these tests out of the developer's
+    own cache."""
+    import tempfile
+    _saved['XDG_CACHE_HOME'] = os.environ.get('XDG_CACHE_HOME')
+    _saved['cache_home'] = tempfile.mkdtemp()
+    os.environ['XDG_CACHE_HOME'] = _saved['cache_home']
+
+def teardown():
+    import shutil
+    if _saved['XDG_CACHE_HOME'] is None:
+        del os.environ['XDG_CACHE_HOME']
+    else:
+        os.environ['XDG_CACHE_HOME'] = _saved['XDG_CACHE_HOME']
+    shutil.rmtree(_saved['cache_home'])
+
 def test_basic_dependencies():
     @tasks.task
     def t1():
@@ -423,7 +441,13 @@ def test_calling_subpavement():
         assert options.foo == 2
     
     env = _set_environment(private_t1=private_t1)
-    tasks._process_commands(['private_t1'])
+    history = os.path.join(os.path.dirname(subpavement), ".paver_history")
+    had_history = os.path.exists(history)
+    try:
+        tasks._process_commands(['private_t1'])
+    finally:
+        if not had_history and os.path.exists(history):
+            os.remove(history)
     # the value should be set by the other pavement, which runs
     # in the same process
     assert OP_T1_CALLED == 1
@@ -460,3 +484,651 @@ def test_calling_a_function_rather_than_task():
         assert False, "Expected a BuildFailure when calling something that is not a task."
     except tasks.BuildFailure:
         pass
+
+def test_jobs_option():
+    env = _set_environment()
+    tasks._parse_global_options([])
+    assert env.jobs == 1
+
+    env = _set_environment()
+    tasks._parse_global_options(['-j', '4'])
+    assert env.jobs == 4
+
+def test_parallel_dependencies_run_once_and_in_order():
+    called = []
+    
+    @tasks.task
+    def t1():
+        called.append('t1')
+    
+    @tasks.task
+    @tasks.needs('t1')
+    def t2():
+        assert 't1' in called
+        called.append('t2')
+    
+    @tasks.task
+    @tasks.needs('t1')
+    def t3():
+        assert 't1' in called
+        called.append('t3')
+    
+    @tasks.task
+    @tasks.needs('t2', 't3')
+    def t4():
+        assert 't2' in called and 't3' in called
+        called.append('t4')
+    
+    env = _set_environment(t1=t1, t2=t2, t3=t3, t4=t4)
+    env.jobs = 4
+    t4()
+    assert sorted(called) == ['t1', 't2', 't3', 't4']
+    assert called[0] == 't1'
+    assert called[-1] == 't4'
+
+def test_independent_dependencies_run_concurrently():
+    import threading
+    t2_started = threading.Event()
+    
+    @tasks.task
+    def t1():
+        t2_started.wait(5)
+        assert t2_started.isSet(), "t2 should have run alongside t1"
+    
+    @tasks.task
+    def t2():
+        t2_started.set()
+    
+    @tasks.task
+    @tasks.needs('t1', 't2')
+    def t3():
+        pass
+    
+    env = _set_environment(t1=t1, t2=t2, t3=t3)
+    env.jobs = 2
+    t3()
+    assert t1.called
+    assert t2.called
+
+def test_parallel_dependency_failure_stops_the_build():
+    @tasks.task
+    def t1():
+        raise tasks.BuildFailure("t1 broke")
+    
+    @tasks.task
+    @tasks.needs('t1')
+    def t2():
+        assert False, "t2 should not run when t1 fails"
+    
+    @tasks.task
+    @tasks.needs('t2')
+    def t3():
+        assert False, "t3 should not run when t1 fails"
+    
+    env = _set_environment(t1=t1, t2=t2, t3=t3, patch_print=True)
+    env.jobs = 2
+    try:
+        tasks._process_commands(['t3'])
+        assert False, "Expecting FakeExitException"
+    except FakeExitException:
+        assert "t1 broke" in "\n".join(env.patch_captured)
+    assert not t2.called
+
+def _in_tempdir(func):
+    import tempfile, shutil
+    def wrapper():
+        cwd = os.getcwd()
+        tmpdir = tempfile.mkdtemp()
+        os.chdir(tmpdir)
+        try:
+            func(tmpdir)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(tmpdir)
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+def _make_up_to_date_tasks():
+    runs = []
+    
+    @tasks.task
+    @tasks.inputs('src/*.txt')
+    @tasks.outputs('out.txt')
+    def build(options):
+        runs.append(1)
+        out = open('out.txt', 'w')
+        for name in sorted(os.listdir('src')):
+            out.write(open(os.path.join('src', name)).read())
+        out.close()
+    return build, runs
+
+def _write(filename, contents):
+    f = open(filename, 'w')
+    f.write(contents)
+    f.close()
+
+@_in_tempdir
+def test_task_with_unchanged_inputs_is_skipped(tmpdir):
+    os.mkdir('src')
+    _write('src/a.txt', 'a')
+    
+    build, runs = _make_up_to_date_tasks()
+    env = _set_environment(build=build)
+    env.pavement_file = os.path.join(tmpdir, 'pavement.py')
+    tasks._process_commands(['build'])
+    assert len(runs) == 1
+    assert os.path.exists('.paver_stamps')
+    
+    build, runs = _make_up_to_date_tasks()
+    env = _set_environment(build=build)
+    env.pavement_file = os.path.join(tmpdir, 'pavement.py')
+    tasks._process_commands(['build'])
+    assert build.called
+    assert not runs
+    
+    # touching a file without changing it does not make the task stale
+    os.utime('src/a.txt', (0, 0))
+    tasks._process_commands(['build'])
+    assert not runs
+
+@_in_tempdir
+def test_stamps_recorded_on_several_threads(tmpdir):
+    import threading
+    stamps = tasks._StampDatabase(os.path.join(tmpdir, '.paver_stamps'))
+    class FakeTask(object):
+        def __init__(self, name):
+            self.name = name
+    errors = []
+    def record(n):
+        try:
+            for i in range(20):
+                state = dict(options='o', files={'f%d' % i: (i, i, 'x')})
+                stamps.record(FakeTask('t%d.%d' % (n, i)), state)
+        except Exception, e:
+            errors.append(e)
+    threads = [threading.Thread(target=record, args=(n,)) 
+               for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert os.listdir(tmpdir) == ['.paver_stamps']
+    saved = tasks._StampDatabase(os.path.join(tmpdir, '.paver_stamps'))
+    assert len(saved._get_all()) == 160
+
+@_in_tempdir
+def test_task_reruns_when_inputs_change(tmpdir):
+    os.mkdir('src')
+    _write('src/a.txt', 'a')
+    
+    build, runs = _make_up_to_date_tasks()
+    env = _set_environment(build=build)
+    env.pavement_file = os.path.join(tmpdir, 'pavement.py')
+    tasks._process_commands(['build'])
+    
+    _write('src/a.txt', 'changed')
+    tasks._process_commands(['build'])
+    assert len(runs) == 2
+    
+    _write('src/b.txt', 'new file')
+    tasks._process_commands(['build'])
+    assert len(runs) == 3
+    
+    os.remove('out.txt')
+    tasks._process_commands(['build'])
+    assert len(runs) == 4
+
+@_in_tempdir
+def test_task_reruns_when_options_change(tmpdir):
+    os.mkdir('src')
+    _write('src/a.txt', 'a')
+    
+    build, runs = _make_up_to_date_tasks()
+    env = _set_environment(build=build)
+    env.pavement_file = os.path.join(tmpdir, 'pavement.py')
+    tasks._process_commands(['build.flavor=plain', 'build'])
+    tasks._process_commands(['build.flavor=plain', 'build'])
+    assert len(runs) == 1
+    tasks._process_commands(['build.flavor=fancy', 'build'])
+    assert len(runs) == 2
+
+@_in_tempdir
+def test_outputs_restored_from_cache_in_another_checkout(tmpdir):
+    cache_dir = os.path.join(tmpdir, 'cache')
+    for checkout in ['one', 'two']:
+        os.mkdir(checkout)
+        os.mkdir(os.path.join(checkout, 'src'))
+        _write(os.path.join(checkout, 'src', 'a.txt'), 'a')
+    
+    os.chdir('one')
+    build, runs = _make_up_to_date_tasks()
+    env = _set_environment(build=build)
+    env.pavement_file = os.path.join(tmpdir, 'one', 'pavement.py')
+    tasks._process_commands(['--cache-dir', cache_dir, 'build'])
+    assert len(runs) == 1
+    
+    os.chdir(os.path.join(tmpdir, 'two'))
+    build, runs = _make_up_to_date_tasks()
+    env = _set_environment(build=build)
+    env.pavement_file = os.path.join(tmpdir, 'two', 'pavement.py')
+    tasks._process_commands(['--cache-dir', cache_dir, 'build'])
+    assert not runs
+    assert open('out.txt').read() == 'a'
+    
+    # different inputs miss the cache
+    _write(os.path.join('src', 'a.txt'), 'b')
+    tasks._process_commands(['--cache-dir', cache_dir, 'build'])
+    assert len(runs) == 1
+
+@_in_tempdir
+def test_unsafe_or_broken_cache_entries_are_misses(tmpdir):
+    import tarfile
+    _set_environment()
+    os.mkdir('project')
+    os.chdir('project')
+    cache = tasks._ResultCache(os.path.join(tmpdir, 'cache'))
+    _write('out.txt', 'output')
+    cache.store('00good', ['out.txt'])
+    os.remove('out.txt')
+    assert cache.restore('00good')
+    assert open('out.txt').read() == 'output'
+    assert not cache.restore('00missing')
+    
+    def make_entry(key, add):
+        entry = cache._entry(key)
+        archive = tarfile.open(entry, 'w:gz')
+        try:
+            add(archive)
+        finally:
+            archive.close()
+        return entry
+    def add_file(name):
+        def add(archive):
+            # (add() would take the / off the start of the name)
+            info = archive.gettarinfo('out.txt')
+            info.name = name
+            archive.addfile(info, open('out.txt', 'rb'))
+        return add
+    def add_link(archive):
+        info = tarfile.TarInfo('link.txt')
+        info.type = tarfile.SYMTYPE
+        info.linkname = os.path.join(tmpdir, 'escaped.txt')
+        archive.addfile(info)
+    make_entry('00abs', add_file(os.path.join(tmpdir, 'escaped.txt')))
+    make_entry('00up', add_file('../escaped.txt'))
+    make_entry('00link', add_link)
+    make_entry('00empty', lambda archive: None)
+    entry = make_entry('00cut', add_file('other.txt'))
+    data = open(entry, 'rb').read()
+    open(entry, 'wb').write(data[:len(data) // 2])
+    for key in ['00abs', '00up', '00link', '00empty', '00cut']:
+        assert not cache.restore(key), key
+    assert not os.path.exists(os.path.join(tmpdir, 'escaped.txt'))
+    assert not os.path.exists('link.txt')
+    
+    # failing to store outputs doesn't fail the task
+    _write(os.path.join(tmpdir, 'not_a_directory'), '')
+    tasks._ResultCache(os.path.join(tmpdir, 'not_a_directory')).store(
+        '00good', ['out.txt'])
+
+def test_get_tasks_uses_the_task_registry():
+    import sys, types
+    from paver import doctools
+    
+    @tasks.task
+    def t1():
+        pass
+    
+    # a task defined in an imported module is found even if the pavement
+    # only gets at it through another module
+    defining = types.ModuleType("paver.tests.defining_module")
+    def reexported():
+        pass
+    reexported.__module__ = defining.__name__
+    defining.reexported = tasks.task(reexported)
+    sys.modules[defining.__name__] = defining
+    reexporting = types.ModuleType("reexporting_module")
+    reexporting.reexported = defining.reexported
+    unrelated = types.ModuleType("unrelated_module")
+    unrelated.stashed = t1
+    try:
+        env = _set_environment(reexporting=reexporting, unrelated=unrelated)
+        task_list = env.get_tasks()
+        assert defining.reexported in task_list
+        assert doctools.html in task_list
+        # t1 was never anything's module-level task
+        assert t1 not in task_list
+        assert env.get_task("reexported") is defining.reexported
+        assert env.get_task("paver.tests.defining_module.reexported") is \
+            defining.reexported
+        assert env.get_task("html") is doctools.html
+    finally:
+        del sys.modules[defining.__name__]
+    
+    env = _set_environment()
+    assert defining.reexported not in env.get_tasks()
+
+def test_global_options_last_until_the_end_of_the_command_line():
+    @tasks.task
+    def t1():
+        pass
+    
+    @tasks.task
+    def t2():
+        pass
+    
+    env = _set_environment(t1=t1, t2=t2)
+    tasks._parse_command_line(['--cache-dir', 'somewhere', '-j', '2', 't1',
+                               't2'])
+    tasks._parse_command_line([])
+    assert env.cache_dir == 'somewhere'
+    assert env.jobs == 2
+
+def test_timings_are_reported():
+    @tasks.task
+    def t0():
+        pass
+    
+    @tasks.task
+    @tasks.needs('t0')
+    def t1():
+        pass
+    
+    env = _set_environment(t0=t0, t1=t1, patch_print=True)
+    tasks._process_commands(['--timings', 't1'])
+    output = "\n".join(env.patch_captured)
+    assert "Task timings" in output
+    assert "paver.tests.test_tasks.t1\n" in output
+    assert "paver.tests.test_tasks.t0 (needed by paver.tests.test_tasks.t1)" \
+        in output
+
+@_in_tempdir
+def test_chrome_trace_is_written(tmpdir):
+    import json
+    
+    @tasks.task
+    def t0():
+        pass
+    
+    @tasks.task
+    @tasks.needs('t0')
+    def t1():
+        pass
+    
+    env = _set_environment(t0=t0, t1=t1, patch_print=True)
+    tasks._process_commands(['--trace-file', 'trace.json', 't1'])
+    trace = json.load(open('trace.json'))
+    events = dict([(event['name'], event) for event in trace['traceEvents']
+                   if event['ph'] == 'X'])
+    t0_event = events['paver.tests.test_tasks.t0']
+    t1_event = events['paver.tests.test_tasks.t1']
+    assert t1_event['ts'] <= t0_event['ts']
+    assert t0_event['args']['needed_by'] == 'paver.tests.test_tasks.t1'
+
+@_in_tempdir
+def test_profile_a_task(tmpdir):
+    @tasks.task
+    def t1():
+        sum(range(1000))
+    
+    env = _set_environment(t1=t1, patch_print=True)
+    tasks._process_commands(['--profile', 't1', 't1'])
+    assert t1.called
+    assert os.path.exists('t1.pstats')
+    assert "Profile of paver.tests.test_tasks.t1" in \
+        "\n".join(env.patch_captured)
+
+@_in_tempdir
+def test_compiled_pavement_is_cached(tmpdir):
+    env = _set_environment()
+    # --cache-dir is for task outputs only
+    env.cache_dir = os.path.join(tmpdir, 'outputs')
+    old_cache_home = os.environ['XDG_CACHE_HOME']
+    os.environ['XDG_CACHE_HOME'] = os.path.join(tmpdir, 'cache')
+    try:
+        _write('pavement.py', 'value = 1\n')
+        os.utime('pavement.py', (1000000000, 1000000000))
+        tasks._compile_pavement('pavement.py')
+        assert len(os.listdir(os.path.join(tmpdir, 'cache', 'paver', 
+                                           'pavements'))) == 1
+        assert not os.path.exists(env.cache_dir)
+        
+        # same size and modification time: the cached code is used
+        _write('pavement.py', 'value = 2\n')
+        os.utime('pavement.py', (1000000000, 1000000000))
+        namespace = {}
+        exec tasks._compile_pavement('pavement.py') in namespace
+        assert namespace['value'] == 1
+        
+        os.utime('pavement.py', (1000000010, 1000000010))
+        exec tasks._compile_pavement('pavement.py') in namespace
+        assert namespace['value'] == 2
+    finally:
+        os.environ['XDG_CACHE_HOME'] = old_cache_home
+
+@_in_tempdir
+def test_task_runs_are_recorded_in_the_history(tmpdir):
+    @tasks.task
+    def t1():
+        pass
+    
+    @tasks.task
+    def t2():
+        raise tasks.BuildFailure("t2 broke")
+    
+    env = _set_environment(t1=t1, t2=t2, patch_print=True)
+    env.history = tasks._BuildHistory(os.path.join(tmpdir, 'history'))
+    try:
+        tasks._process_commands(['t2'])
+    except FakeExitException:
+        pass
+    tasks._process_commands(['t1'])
+    runs = env.history.runs()
+    assert [(run['name'], run['status']) for run in runs] == [
+        ('paver.tests.test_tasks.t2', 'failed'),
+        ('paver.tests.test_tasks.t1', 'ok')]
+    assert runs[1]['end'] >= runs[1]['start']
+    assert env.history.average_durations().keys() == \
+        ['paver.tests.test_tasks.t1']
+
+@_in_tempdir
+def test_dry_runs_are_not_recorded_in_the_history(tmpdir):
+    @tasks.task
+    def t1():
+        pass
+    
+    env = _set_environment(t1=t1, patch_print=True)
+    env.history = tasks._BuildHistory(os.path.join(tmpdir, 'history'))
+    tasks._process_commands(['-n', 't1'])
+    assert env.history.runs() == []
+
+@_in_tempdir
+def test_parallel_tasks_run_slowest_first(tmpdir):
+    import time
+    started = []
+    def make_task(name):
+        def func():
+            started.append(name)
+            time.sleep(0.05)
+        func.__name__ = name
+        return tasks.task(func)
+    t1, t2, t3 = [make_task(name) for name in ('t1', 't2', 't3')]
+    
+    @tasks.task
+    @tasks.needs(['t1', 't2', 't3'])
+    def all():
+        pass
+    
+    _write('history', 
+        'paver.tests.test_tasks.t2\t0\t5\t5\tok\t-\thost\n'
+        'paver.tests.test_tasks.t3\t0\t9\t9\tok\t-\thost\n')
+    env = _set_environment(t1=t1, t2=t2, t3=t3, all=all)
+    env.history = tasks._BuildHistory('history')
+    env.jobs = 2
+    tasks._process_commands(['all'])
+    assert sorted(started[:2]) == ['t2', 't3'], started
+    assert started[2] == 't1'
+
+def test_path_lengths_follow_the_longest_chain():
+    class T(object):
+        def __init__(self, name):
+            self.name = name
+    a, b, c, d = [T(name) for name in "abcd"]
+    graph = {a: [b, c], b: [d], c: [], d: []}
+    lengths = tasks._path_lengths(graph, dict(a=1, b=2, c=4, d=3))
+    assert lengths[d] == 3
+    assert lengths[b] == 5
+    assert lengths[a] == 6
+
+@_in_tempdir
+def test_graph_shows_the_critical_path(tmpdir):
+    import json
+    from paver import misctasks
+    
+    @tasks.task
+    def t1():
+        pass
+    
+    @tasks.task
+    def t2():
+        pass
+    
+    @tasks.task
+    @tasks.needs(['t1', 't2'])
+    def t3():
+        pass
+    
+    _write('history', 
+        'paver.tests.test_tasks.t1\t0\t1\t1\tok\t-\thost\n'
+        'paver.tests.test_tasks.t2\t0\t3\t3\tok\t-\thost\n')
+    env = _set_environment(t1=t1, t2=t2, t3=t3, graph=misctasks.graph)
+    env.history = tasks._BuildHistory('history')
+    tasks._process_commands(['graph', '-f', 'json', '-o', 'graph.json'])
+    graph = json.load(open('graph.json'))
+    assert graph['critical_path'] == ['paver.tests.test_tasks.t3', 
+                                      'paver.tests.test_tasks.t2']
+    assert graph['critical_path_duration'] == 3
+    t3_info = [t for t in graph['tasks'] 
+               if t['name'] == 'paver.tests.test_tasks.t3'][0]
+    assert t3_info['needs'] == ['paver.tests.test_tasks.t1', 
+                                'paver.tests.test_tasks.t2']
+    assert t3_info['average_duration'] is None
+
+def test_long_task_output_is_spilled_to_a_file():
+    import gzip
+    
+    @tasks.task
+    def t1():
+        for i in range(100):
+            tasks.environment.debug("line %d", i)
+        raise tasks.BuildFailure("t1 broke")
+    
+    env = _set_environment(t1=t1, patch_print=True)
+    old_sizes = tasks._TaskOutput.spill_size, tasks._TaskOutput.tail_lines
+    tasks._TaskOutput.spill_size = 100
+    tasks._TaskOutput.tail_lines = 10
+    try:
+        try:
+            tasks._process_commands(['t1'])
+            assert False, "Expecting FakeExitException"
+        except FakeExitException:
+            pass
+    finally:
+        tasks._TaskOutput.spill_size, tasks._TaskOutput.tail_lines = \
+            old_sizes
+    output = "\n".join(env.patch_captured)
+    assert "line 99" in output
+    assert "line 89\n" not in output
+    note = [line for line in env.patch_captured 
+            if line.startswith("(only the last 10 lines")][0]
+    filename = note.split(" is in ")[1].rstrip(")\n")
+    try:
+        spilled = gzip.open(filename).read().splitlines()
+    finally:
+        os.remove(filename)
+    assert spilled[0] == "---> paver.tests.test_tasks.t1"
+    assert spilled[-1] == "line 99"
+
+def test_large_arguments_count_towards_the_spill_size():
+    import gzip
+    
+    @tasks.task
+    def t1():
+        tasks.environment.debug("%s", "x" * (2 * 1024 * 1024))
+        tasks.environment.debug("done")
+        raise tasks.BuildFailure("t1 broke")
+    
+    env = _set_environment(t1=t1, patch_print=True)
+    old_tail_lines = tasks._TaskOutput.tail_lines
+    tasks._TaskOutput.tail_lines = 1
+    try:
+        try:
+            tasks._process_commands(['t1'])
+            assert False, "Expecting FakeExitException"
+        except FakeExitException:
+            pass
+    finally:
+        tasks._TaskOutput.tail_lines = old_tail_lines
+    note = [line for line in env.patch_captured 
+            if line.startswith("(only the last 1 lines")][0]
+    filename = note.split(" is in ")[1].rstrip(")\n")
+    try:
+        spilled = gzip.open(filename).read().splitlines()
+    finally:
+        os.remove(filename)
+    assert spilled[1] == "x" * (2 * 1024 * 1024)
+    assert spilled[-1] == "done"
+
+def test_messages_are_only_formatted_when_needed():
+    formatted = []
+    class Expensive(object):
+        def __str__(self):
+            formatted.append(1)
+            return "expensive"
+    
+    env = _set_environment(patch_print=True)
+    env.debug("%s", Expensive())
+    assert not formatted
+    env.verbose = True
+    env.debug("%s", Expensive())
+    assert formatted
+    assert env.patch_captured == ["expensive"]
+
+def test_captured_messages_are_formatted_when_logged():
+    @tasks.task
+    def t1():
+        items = ["a"]
+        tasks.environment.debug("items: %s", items)
+        items.append("later")
+        tasks.environment.debug("count: %d", "oops")
+        raise tasks.BuildFailure("real error")
+    
+    env = _set_environment(t1=t1, patch_print=True)
+    try:
+        tasks._process_commands(['t1'])
+        assert False, "Expecting FakeExitException"
+    except FakeExitException:
+        pass
+    output = "\n".join(env.patch_captured)
+    assert "items: ['a']\n" in output, output
+    assert "'count: %d' % ('oops',) (could not format:" in output
+    assert "real error" in output
+
+@_in_tempdir
+def test_log_records_written_as_json(tmpdir):
+    import json
+    
+    @tasks.task
+    def t1():
+        tasks.environment.debug("hello %s", "there")
+    
+    env = _set_environment(t1=t1, patch_print=True)
+    tasks._process_commands(['--log-json', 'log.json', 't1'])
+    env.log_json = None
+    records = [json.loads(line) for line in open('log.json')]
+    assert records[-1]['message'] == 'hello there'
+    assert records[-1]['level'] == 'debug'
+    assert records[-1]['task'] == 'paver.tests.test_tasks.t1'
+    assert records[-2]['message'] == '---> paver.tests.test_tasks.t1'
+    assert records[-2]['level'] == 'info'
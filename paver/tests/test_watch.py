@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import threading
+
+from paver import tasks, watch
+from paver.tests.utils import _set_environment
+
+def _write(filename, contents):
+    f = open(filename, 'w')
+    f.write(contents)
+    f.close()
+
+def test_needed_tasks_are_watched_too():
+    @tasks.task
+    @tasks.inputs('a')
+    def t1():
+        pass
+    
+    @tasks.task
+    @tasks.needs('t1')
+    def t2():
+        pass
+    
+    _set_environment(t1=t1, t2=t2)
+    assert watch._needed_tasks([t2]) == [t2, t1]
+
+def _check_wait_for_change(make_watcher):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        src = os.path.join(tmpdir, 'src')
+        os.mkdir(src)
+        _write(os.path.join(src, 'a.txt'), 'a')
+        watcher = make_watcher([src])
+        try:
+            def change():
+                _write(os.path.join(src, 'b.txt'), 'b')
+            timer = threading.Timer(0.2, change)
+            timer.start()
+            watch._wait_for_change([src], watcher, watch._snapshot([src]))
+            assert os.path.exists(os.path.join(src, 'b.txt'))
+        finally:
+            watcher.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_polling_notices_new_files():
+    original = watch.poll_interval
+    watch.poll_interval = 0.1
+    try:
+        _check_wait_for_change(lambda patterns: watch._PollingWatcher())
+    finally:
+        watch.poll_interval = original
+
+def test_inotify_notices_new_files():
+    try:
+        watch._InotifyWatcher([tempfile.gettempdir()]).close()
+    except Exception:
+        # no inotify on this platform
+        return
+    _check_wait_for_change(watch._InotifyWatcher)
+
+def test_changes_made_while_tasks_run_are_noticed():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        src = os.path.join(tmpdir, 'src')
+        os.mkdir(src)
+        
+        @tasks.task
+        @tasks.inputs(src)
+        def t1():
+            pass
+        
+        _set_environment(t1=t1)
+        snapshot = watch.inputs_snapshot([t1])
+        # saved while t1 runs
+        _write(os.path.join(src, 'a.txt'), 'a')
+        # returns right away, without waiting for another change
+        watch._wait_for_change([src], watch._PollingWatcher(), snapshot)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -54,7 +54,7 @@ def after_install(options, home_dir):
         
         debug("Bootstrap script extra text: " + extra_text)
         def write_script():
-            open(fn, "w").write(bootstrap_contents)
+            path(fn).write_text(bootstrap_contents, if_changed=True)
         dry("Write bootstrap script %s" % (fn), write_script)
         
                 
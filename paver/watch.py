@@ -0,0 +1,203 @@
+"""Runs tasks again whenever the files they depend on change (paver -w).
+
+The files watched are the @inputs of the tasks given on the command line
+and of all of the tasks they need. On Linux, inotify is used to wait for
+changes; elsewhere, the files are polled. Bursts of changes (an editor
+saving several files, say) are collected until things have been quiet for
+a moment, and then the tasks are run again in the same process. Tasks
+whose inputs did not change are skipped as usual."""
+
+import os
+import sys
+import time
+import errno
+import select
+import traceback
+
+from paver import tasks
+from paver.tasks import BuildFailure, Task
+
+# seconds without further changes before the tasks are run again
+debounce = 0.3
+# seconds between checks when polling
+poll_interval = 1.0
+
+def watch(tasks_to_run, snapshot=None):
+    """Runs tasks_to_run again each time their inputs change, until
+    interrupted. snapshot is what the inputs looked like before the 
+    tasks were last run (see inputs_snapshot), so that changes made 
+    while they ran start another run; by default, it is taken now."""
+    environment = tasks.environment
+    all_tasks = _needed_tasks(tasks_to_run)
+    patterns = _input_patterns(all_tasks)
+    if not patterns:
+        raise BuildFailure("There is nothing to watch. Use @inputs to "
+                           "declare the files that tasks depend on.")
+    if snapshot is None:
+        snapshot = _snapshot(patterns)
+    watcher = _make_watcher(patterns)
+    try:
+        try:
+            while True:
+                environment.info("Watching for changes "
+                                 "(press Ctrl-C to stop)")
+                _wait_for_change(patterns, watcher, snapshot)
+                snapshot = _snapshot(patterns)
+                for task in all_tasks:
+                    task.called = False
+                for task in tasks_to_run:
+                    try:
+                        task()
+                    except SystemExit:
+                        break
+                    except BuildFailure, e:
+                        environment.error("Build failed: %s", e)
+                        break
+                    except Exception:
+                        environment.error(traceback.format_exc())
+                        break
+                environment._report_timings()
+        except KeyboardInterrupt:
+            pass
+    finally:
+        watcher.close()
+
+def inputs_snapshot(tasks_to_run):
+    """What the inputs of tasks_to_run (and of the tasks they need) look
+    like now, to pass to watch once the tasks have run."""
+    return _snapshot(_input_patterns(_needed_tasks(tasks_to_run)))
+
+def _needed_tasks(tasks_to_run):
+    """The tasks given along with everything they need, in turn."""
+    result = []
+    def add(task):
+        if task in result:
+            return
+        result.append(task)
+        for req in task.needs:
+            needed = tasks.environment.get_task(req)
+            if isinstance(needed, Task):
+                add(needed)
+    for task in tasks_to_run:
+        add(task)
+    return result
+
+def _input_patterns(all_tasks):
+    patterns = []
+    for task in all_tasks:
+        patterns.extend(task.inputs)
+    return patterns
+
+def _snapshot(patterns):
+    result = {}
+    for filename in tasks._expand_files(patterns):
+        try:
+            st = os.stat(filename)
+        except OSError:
+            continue
+        result[filename] = (st.st_mtime, st.st_size)
+    return result
+
+def _wait_for_change(patterns, watcher, snapshot):
+    """Returns once the files matching patterns differ from snapshot and
+    have then stayed the same for debounce seconds."""
+    current = _snapshot(patterns)
+    while current == snapshot:
+        watcher.wait(poll_interval)
+        current = _snapshot(patterns)
+    while True:
+        had_events = watcher.wait(debounce)
+        latest = _snapshot(patterns)
+        if not had_events and latest == current:
+            break
+        current = latest
+
+def _make_watcher(patterns):
+    if sys.platform.startswith("linux"):
+        try:
+            return _InotifyWatcher(patterns)
+        except (ImportError, OSError, AttributeError), e:
+            tasks.environment.debug("Not using inotify: %s", e)
+    return _PollingWatcher()
+
+class _PollingWatcher(object):
+    def wait(self, timeout):
+        """Sleeps for timeout seconds. Polling can't tell whether anything
+        happened in the meantime, so this always returns False and the
+        caller compares snapshots instead."""
+        time.sleep(timeout)
+        return False
+
+    def close(self):
+        pass
+
+def _watched_directories(patterns):
+    """The directories in which the files matching patterns can appear:
+    the part of each pattern before the first wildcard, and everything
+    below it."""
+    result = set()
+    for pattern in patterns:
+        base = []
+        for part in pattern.split(os.sep):
+            if "*" in part or "?" in part or "[" in part:
+                break
+            base.append(part)
+        base = os.sep.join(base) or os.curdir
+        if not os.path.isdir(base):
+            base = os.path.dirname(base) or os.curdir
+        if not os.path.isdir(base):
+            continue
+        for dirpath, dirnames, filenames in os.walk(base):
+            result.add(dirpath)
+    return result
+
+# from <sys/inotify.h>
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_DELETE_SELF = 0x400
+_IN_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM |
+            _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF)
+
+class _InotifyWatcher(object):
+    """Waits for changes in the watched directories using inotify,
+    called through ctypes."""
+    def __init__(self, patterns):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                           use_errno=True)
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        try:
+            for dirname in _watched_directories(patterns):
+                if libc.inotify_add_watch(self.fd, dirname, _IN_MASK) < 0:
+                    raise OSError(ctypes.get_errno(),
+                                  "Can't watch %s" % dirname)
+        except:
+            os.close(self.fd)
+            raise
+
+    def wait(self, timeout):
+        """Waits up to timeout seconds for changes. Returns True if there
+        were any."""
+        try:
+            ready = select.select([self.fd], [], [], timeout)[0]
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return False
+            raise
+        if not ready:
+            return False
+        # the events themselves don't matter, the caller looks at the
+        # files to see what changed
+        os.read(self.fd, 65536)
+        return True
+
+    def close(self):
+        os.close(self.fd)